@@ -0,0 +1,60 @@
+import os, time, asyncio, logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", "1.5"))  # segundos sem novas partes para fechar o álbum
+
+class AlbumAggregator:
+    """
+    Junta as partes de um álbum (media_group_id) sem segurar lock durante a espera.
+    Cada nova parte empurra o prazo; uma única tarefa por álbum dorme até o prazo
+    vencer e então entrega o álbum inteiro, ordenado por message_id, para
+    on_flush(chave, partes). As partes são o que o chamador quiser guardar
+    (ex: payloads.AlbumPart), não precisam ser o Message inteiro.
+    Se o total de partes já é conhecido (expect), o álbum fecha assim que a
+    última chegar, sem esperar a janela.
+    """
+
+    def __init__(self, on_flush, window: float = ALBUM_WINDOW):
+        self._on_flush = on_flush
+        self.window = window
+        self._albums: dict[tuple, list] = {}  # (chat_id, media_group_id) -> [partes, prazo, completo]
+        self._expected: OrderedDict = OrderedDict()  # chave -> total de partes, quando já se sabe
+
+    def add(self, key: tuple, part):
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = [[], 0.0, asyncio.Event()]
+            asyncio.create_task(self._flush_later(key, album))
+        album[0].append(part)
+        album[1] = time.monotonic() + self.window
+        if len(album[0]) >= self._expected.get(key, float("inf")):
+            album[2].set()
+
+    def expect(self, key: tuple, count: int):
+        """O álbum tem `count` partes (ex: o lote do getUpdates já mostrou o fim dele)."""
+        album = self._albums.get(key)
+        if album is not None and len(album[0]) >= count:
+            album[2].set()
+            return
+        self._expected[key] = count
+        while len(self._expected) > 1000:  # álbuns que nunca chegaram ao buffer
+            self._expected.popitem(last=False)
+
+    async def _flush_later(self, key, album):
+        while (delay := album[1] - time.monotonic()) > 0 and not album[2].is_set():
+            try:
+                await asyncio.wait_for(album[2].wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        self._albums.pop(key, None)
+        self._expected.pop(key, None)
+        parts = sorted(album[0], key=lambda m: m.message_id)
+        try:
+            await self._on_flush(key, parts)
+        except Exception as e:
+            logger.error("Erro ao entregar álbum %s: %s", key[1], e)
+
+    def __len__(self):
+        return len(self._albums)
@@ -0,0 +1,104 @@
+"""
+Servidor falso do Bot API para benchmarks.
+
+Responde aos métodos que o bot usa, registra cada chamada (método, chat, horário)
+e simula latência, 429 (RetryAfter) e 403 (Forbidden) para chats escolhidos.
+"""
+import time, random, asyncio, json
+from urllib.parse import parse_qsl
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0, p429: float = 0.0, retry_after: int = 1, forbidden=(),
+                 owner_id: int = 1):
+        self.owner_id = owner_id  # criador devolvido por getChatAdministrators
+        self.latency = latency
+        self.p429 = p429
+        self.retry_after = retry_after
+        self.forbidden = set(forbidden)
+        self.calls: list[tuple] = []          # (método, chat_id, dados, horário)
+        self.updates: list[dict] = []         # servidos por getUpdates (UPDATE_MODE=polling)
+        self._next_id = 1_000_000
+        self.app = FastAPI()
+        self.app.post("/bot{token}/{method}")(self.handle)
+
+    def reset(self):
+        self.calls.clear()
+
+    def _mid(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def _message(self, chat_id, **extra) -> dict:
+        return {"message_id": self._mid(), "date": int(time.time()),
+                "chat": {"id": int(chat_id), "type": "channel"}, **extra}
+
+    async def _payload(self, request: Request) -> dict:
+        # sem upload de arquivos o PTB manda application/x-www-form-urlencoded
+        body = (await request.body()).decode()
+        if request.headers.get("content-type", "").startswith("application/json"):
+            data = json.loads(body) if body else {}
+        else:
+            data = dict(parse_qsl(body))
+        for key, value in list(data.items()):
+            if isinstance(value, str) and value[:1] in "[{":
+                try:
+                    data[key] = json.loads(value)
+                except ValueError:
+                    pass
+        return data
+
+    async def _get_updates(self, data: dict) -> list[dict]:
+        offset, limit = int(data.get("offset") or 0), int(data.get("limit") or 100)
+        deadline = time.monotonic() + min(float(data.get("timeout") or 0), 1.0)
+        while True:
+            # ordena na resposta: updates podem ter chegado durante a espera
+            self.updates = sorted((u for u in self.updates if u["update_id"] >= offset), key=lambda u: u["update_id"])
+            if self.updates or time.monotonic() >= deadline:
+                return self.updates[:limit]
+            await asyncio.sleep(0.01)
+
+    async def handle(self, token: str, method: str, request: Request):
+        data = await self._payload(request)
+        if method.lower() == "getupdates":
+            return {"ok": True, "result": await self._get_updates(data)}
+        chat_id = data.get("chat_id")
+        self.calls.append((method, chat_id, data, time.perf_counter()))
+        if self.latency:
+            await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        if chat_id is not None and int(chat_id) in self.forbidden:
+            return JSONResponse({"ok": False, "error_code": 403,
+                                 "description": "Forbidden: bot was kicked from the channel chat"}, 403)
+        if self.p429 and method.startswith(("copy", "send")) and random.random() < self.p429:
+            return JSONResponse({"ok": False, "error_code": 429,
+                                 "description": f"Too Many Requests: retry after {self.retry_after}",
+                                 "parameters": {"retry_after": self.retry_after}}, 429)
+        return {"ok": True, "result": self.result(method, data)}
+
+    def result(self, method: str, data: dict):
+        method = method.lower()
+        chat_id = data.get("chat_id", 0)
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method == "getwebhookinfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method == "copymessage":
+            return {"message_id": self._mid()}
+        if method == "copymessages":
+            return [{"message_id": self._mid()} for _ in data.get("message_ids", [])]
+        if method == "sendmediagroup":
+            return [self._message(chat_id, photo=[{"file_id": m.get("media"), "file_unique_id": "u",
+                                                    "width": 1, "height": 1}])
+                    for m in data.get("media", [])]
+        if method in ("sendmessage", "editmessagetext", "editmessagecaption"):
+            return self._message(chat_id, text=data.get("text", ""))
+        if method == "getchatadministrators":
+            return [{"status": "creator", "is_anonymous": False,
+                     "user": {"id": self.owner_id, "is_bot": False, "first_name": "dono"}}]
+        if method == "getchatmembercount":
+            return 1000
+        if method == "getchat":
+            return {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else -1, "type": "channel",
+                    "title": "canal"}
+        return True
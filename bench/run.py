@@ -0,0 +1,252 @@
+"""
+Benchmark de carga do bot contra um Bot API falso local.
+
+Sobe o servidor falso (bench/fake_bot_api.py) e o app FastAPI do bot com uvicorn,
+popula o esquema com grupos e canais sintéticos e dispara channel_post, álbuns e
+callbacks em /webhook. Mede vazão, latência de replicação (p50/p99, do envio do
+update até a última cópia chegar ao Bot API) e chamadas ao Bot API por post.
+Os resultados vão para bench/results/<data>.json e podem ser comparados com --compare.
+
+    python bench/run.py --groups 10 --channels 10 --posts 300 --albums 20 --callbacks 50
+    python bench/run.py --latency 0.05 --p429 0.02 --forbidden 3 --compare bench/results/anterior.json
+    python bench/run.py --mode polling --posts 2000   # backlog inteiro servido por getUpdates
+"""
+import os, sys, json, time, random, asyncio, argparse, statistics
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--groups", type=int, default=5)
+    p.add_argument("--channels", type=int, default=5, help="canais por grupo")
+    p.add_argument("--posts", type=int, default=100)
+    p.add_argument("--albums", type=int, default=10)
+    p.add_argument("--album-size", type=int, default=4)
+    p.add_argument("--callbacks", type=int, default=20)
+    p.add_argument("--mode", choices=("webhook", "polling"), default="webhook",
+                   help="polling: todos os updates já esperam no getUpdates (recuperação de backlog)")
+    p.add_argument("--rate", type=float, default=0, help="updates/s enviados (0 = o mais rápido possível)")
+    p.add_argument("--latency", type=float, default=0.0, help="latência simulada do Bot API (s)")
+    p.add_argument("--p429", type=float, default=0.0, help="probabilidade de 429 em envios")
+    p.add_argument("--forbidden", type=int, default=0, help="quantos canais respondem 403")
+    p.add_argument("--global-rate", type=float, default=30)
+    p.add_argument("--per-chat-rate", type=float, default=1)
+    p.add_argument("--database", default=f"sqlite:///{ROOT / 'bench' / 'bench.db'}")
+    p.add_argument("--timeout", type=float, default=120, help="espera máxima pelas entregas (s)")
+    p.add_argument("--out", default=str(ROOT / "bench" / "results"))
+    p.add_argument("--compare", help="resultado anterior (.json) para comparar")
+    p.add_argument("--api-port", type=int, default=18081)
+    p.add_argument("--bot-port", type=int, default=18080)
+    return p.parse_args()
+
+def configure_env(args):
+    if args.database.startswith("sqlite:///"):
+        Path(args.database[len("sqlite:///"):]).unlink(missing_ok=True)
+    os.environ.update({
+        "TELEGRAM_TOKEN": "1:bench",
+        "DATABASE_URL": args.database,
+        "WEBHOOK_URL": f"http://127.0.0.1:{args.bot_port}/webhook",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{args.api_port}/bot",
+        "SEND_GLOBAL_RATE": str(args.global_rate),
+        "SEND_PER_CHAT_RATE": str(args.per_chat_rate),
+        "DELIVERY_MODE": "inline",
+        "UPDATE_MODE": args.mode,
+    })
+
+def seed(args) -> dict[int, list[int]]:
+    """Cria grupos e canais; devolve canal -> destinos esperados."""
+    from db import session_scope, User, Channel, Group, GroupChannel
+    from migrations import init_schema
+    init_schema()
+    members: dict[int, list[int]] = {}
+    with session_scope() as sess:
+        sess.add(User(id=1, username="bench"))
+        sess.flush()
+        for g in range(1, args.groups + 1):
+            sess.add(Group(id=g, name=f"grupo {g}", owner_id=1))
+            for c in range(args.channels):
+                cid = -1_000_000_000_000 - g * 1000 - c
+                sess.add(Channel(id=cid, owner_id=1, username=f"c{g}_{c}", title=f"canal {g}.{c}", authenticated=True))
+                sess.add(GroupChannel(group_id=g, channel_id=cid, inviter_id=1, accepted=True))
+                members.setdefault(g, []).append(cid)
+    return {cid: [d for d in chans if d != cid] for chans in members.values() for cid in chans}
+
+def build_updates(args, routes):
+    channels = list(routes)
+    updates, posts = [], []
+    uid, mid = 1, 1
+    now = int(time.time())
+    for _ in range(args.posts):
+        ch = random.choice(channels)
+        updates.append({"update_id": uid, "channel_post": {
+            "message_id": mid, "date": now, "text": f"post {mid}",
+            "chat": {"id": ch, "type": "channel", "title": "canal"}}})
+        posts.append((uid, ch, mid))
+        uid, mid = uid + 1, mid + 1
+    for a in range(args.albums):
+        ch = random.choice(channels)
+        first = mid
+        for i in range(args.album_size):
+            updates.append({"update_id": uid, "channel_post": {
+                "message_id": mid, "date": now, "media_group_id": f"album{a}",
+                **({"caption": f"álbum {a} & <legenda>"} if i == 0 else {}),
+                "photo": [{"file_id": f"{ch}:{mid}", "file_unique_id": f"u{mid}", "width": 1, "height": 1}],
+                "chat": {"id": ch, "type": "channel", "title": "canal"}}})
+            uid, mid = uid + 1, mid + 1
+        posts.append((uid - 1, ch, first))
+    for i in range(args.callbacks):
+        updates.append({"update_id": uid, "callback_query": {
+            "id": f"cb{i}", "chat_instance": "bench", "data": "explorar_grupos",
+            "from": {"id": 1, "is_bot": False, "first_name": "bench"},
+            "message": {"message_id": 1, "date": now, "text": "menu",
+                        "chat": {"id": 1, "type": "private", "first_name": "bench"}}}})
+        uid += 1
+    random.shuffle(updates)
+    # partes de um álbum chegam em ordem, como no Telegram
+    updates.sort(key=lambda u: (u.get("channel_post", {}).get("media_group_id") or "", u["update_id"])
+                 if u.get("channel_post", {}).get("media_group_id") else ("", 0))
+    return updates, posts
+
+def deliveries(api) -> dict[tuple, dict[int, float]]:
+    """(canal de origem, id de origem) -> {destino: horário da entrega}."""
+    seen: dict[tuple, dict[int, float]] = {}
+    for method, chat_id, data, at in api.calls:
+        method = method.lower()
+        if method == "copymessage":
+            keys = [(int(data["from_chat_id"]), int(data["message_id"]))]
+        elif method == "copymessages":
+            keys = [(int(data["from_chat_id"]), int(m)) for m in data["message_ids"]]
+        elif method == "sendmediagroup":
+            src, first = data["media"][0]["media"].split(":")
+            keys = [(int(src), int(first))]
+        else:
+            continue
+        for key in keys:
+            seen.setdefault(key, {}).setdefault(int(chat_id), at)
+    return seen
+
+def sum_by_label(metrics_text: str, metric: str, label: str) -> dict[str, int]:
+    """Soma um contador de /metrics por um dos rótulos (ex: bot_api_calls_total por outcome)."""
+    totals: dict[str, int] = {}
+    for line in metrics_text.splitlines():
+        if line.startswith(metric + "{") and f'{label}="' in line:
+            value = line.split(f'{label}="', 1)[1].split('"', 1)[0]
+            totals[value] = totals.get(value, 0) + int(float(line.rsplit(" ", 1)[1]))
+    return totals
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+async def main(args):
+    configure_env(args)
+    import uvicorn, httpx
+    from fake_bot_api import FakeBotAPI
+
+    api = FakeBotAPI(latency=args.latency, p429=args.p429)
+    api_server = uvicorn.Server(uvicorn.Config(api.app, port=args.api_port, log_level="warning"))
+    api_task = asyncio.create_task(api_server.serve())
+    while not api_server.started:
+        await asyncio.sleep(0.05)
+
+    import bot
+    routes = seed(args)
+    forbidden = random.sample(list(routes), min(args.forbidden, len(routes)))
+    api.forbidden = set(forbidden)
+    bot_server = uvicorn.Server(uvicorn.Config(bot.app, port=args.bot_port, log_level="warning"))
+    bot_task = asyncio.create_task(bot_server.serve())
+    while not bot_server.started:
+        await asyncio.sleep(0.05)
+    api.reset()
+
+    updates, posts = build_updates(args, routes)
+    sent_at: dict[int, float] = {}
+    webhook_times = []
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.bot_port}") as client:
+        start = time.perf_counter()
+        if args.mode == "polling":
+            sent_at = {u["update_id"]: start for u in updates}
+            api.updates.extend(updates)
+        for update in updates if args.mode == "webhook" else ():
+            t0 = time.perf_counter()
+            resp = await client.post("/webhook", json=update)
+            webhook_times.append(time.perf_counter() - t0)
+            resp.raise_for_status()
+            sent_at[update["update_id"]] = t0
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+        ingest_seconds = time.perf_counter() - start
+
+        # canais com 403 não autenticam (não replicam) nem recebem cópias
+        posts = [p for p in posts if p[1] not in api.forbidden]
+        expected = {(ch, mid): [d for d in routes[ch] if d not in api.forbidden] for _, ch, mid in posts}
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline:
+            seen = deliveries(api)
+            if all(set(dests) <= set(seen.get(key, {})) for key, dests in expected.items()):
+                break
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - start
+        metrics_text = (await client.get("/metrics")).text
+
+    seen = deliveries(api)
+    latencies, complete = [], 0
+    for update_id, ch, mid in posts:
+        got = seen.get((ch, mid), {})
+        dests = expected[(ch, mid)]
+        if dests and set(dests) <= set(got):
+            complete += 1
+            latencies.append(max(got[d] for d in dests) - sent_at[update_id])
+    methods: dict[str, int] = {}
+    for method, *_ in api.calls:
+        methods[method] = methods.get(method, 0) + 1
+    result = {
+        "when": datetime.now().isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "updates": len(updates),
+        "posts": len(posts),
+        "posts_complete": complete,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_posts_s": round(complete / elapsed, 2) if elapsed else None,
+        "webhook_p50_ms": round(statistics.median(webhook_times) * 1000, 2) if webhook_times else None,
+        "webhook_p99_ms": round(percentile(webhook_times, 0.99) * 1000, 2) if webhook_times else None,
+        "ingest_updates_s": round(len(updates) / ingest_seconds, 1) if webhook_times else None,
+        "replication_p50_s": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "replication_p99_s": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "api_calls": len(api.calls),
+        "api_calls_per_post": round(sum(n for m, n in methods.items() if m.lower().startswith(("copy", "send")))
+                                    / max(1, len(posts)), 2),
+        "api_calls_by_method": methods,
+        "api_outcomes": sum_by_label(metrics_text, "bot_api_calls_total", "outcome"),
+        "http_connections": sum_by_label(metrics_text, "bot_http_requests_total", "connection"),
+        "db_queries_per_update": round(sum(sum_by_label(metrics_text, "bot_db_queries_total", "kind").values())
+                                       / len(updates), 2),
+    }
+
+    bot_server.should_exit = api_server.should_exit = True
+    await asyncio.gather(bot_task, api_task)
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    path = out / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    path.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+    print(json.dumps({k: v for k, v in result.items() if k != "params"}, indent=2, ensure_ascii=False))
+    print(f"💾 Resultado salvo em {path}")
+    if args.compare:
+        compare(json.loads(Path(args.compare).read_text()), result)
+
+def compare(before: dict, after: dict):
+    print("\n📊 Comparação (antes → depois)")
+    for key in ("throughput_posts_s", "replication_p50_s", "replication_p99_s", "webhook_p99_ms", "api_calls_per_post"):
+        a, b = before.get(key), after.get(key)
+        delta = f" ({(b - a) / a:+.1%})" if isinstance(a, (int, float)) and isinstance(b, (int, float)) and a else ""
+        print(f"  {key}: {a} → {b}{delta}")
+
+if __name__ == "__main__":
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    asyncio.run(main(parse_args()))
@@ -1,57 +1,181 @@
 # bot.py
-import os, logging
+import os, time, asyncio, logging
 from fastapi import FastAPI, Request
-from telegram import Update, Bot
+from fastapi.responses import JSONResponse, Response
+from telegram import Update
 from telegram.ext import (
-    ApplicationBuilder, CommandHandler,
-    CallbackQueryHandler, MessageHandler, ContextTypes, filters
+    ApplicationBuilder, CommandHandler, CallbackQueryHandler,
+    ChatMemberHandler, MessageHandler, ContextTypes, filters
 )
 from handlers import (
     start, channel_authenticate, new_post,
-    handle_callback_query, handle_text_message
+    handle_callback_query, handle_text_message, handle_my_chat_member,
+    handle_edited_post, handle_delete_command, warm_caches, prefetch_batch
 )
+from routing import routing
+from queue_worker import health, HEALTH_REFRESH_INTERVAL, DELIVERY_MODE
+from ledger import ledger
+import metrics
+from bot_client import bot
+import migrations
+import tracing
+from ingest import UpdateIngestor
+from poller import UpdatePoller
+from partition import Partitioner, partition_key
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-TOKEN = os.getenv("TELEGRAM_TOKEN")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 PORT = int(os.getenv("PORT", "10000"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None  # confere o header X-Telegram-Bot-Api-Secret-Token
+# webhook: o Telegram chama /webhook; polling: getUpdates em lotes (local, self-hosted ou para zerar backlog)
+UPDATE_MODE = os.getenv("UPDATE_MODE", "webhook")
+# auto: só registra quando URL/allowed_updates mudaram; always: registra a cada boot; off: nunca
+WEBHOOK_REGISTRATION = os.getenv("WEBHOOK_REGISTRATION", "auto")
+ALLOWED_UPDATES = ["message", "channel_post", "edited_channel_post", "callback_query", "my_chat_member"]
 
-bot_app = ApplicationBuilder().token(TOKEN).build()
+bot_app = ApplicationBuilder().bot(bot).build()
 
 # ✅ Handler combinado para mensagens de canal
 async def handle_channel_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if await handle_delete_command(update, context):
+        return
     await channel_authenticate(update, context)
     await new_post(update, context)
 
 # 📌 Registra comandos e handlers
 bot_app.add_handler(CommandHandler("start", start))
-bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
+bot_app.add_handler(MessageHandler(filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND, handle_text_message))
 bot_app.add_handler(CallbackQueryHandler(handle_callback_query))
-bot_app.add_handler(MessageHandler(filters.ChatType.CHANNEL, handle_channel_post))
+bot_app.add_handler(MessageHandler(filters.UpdateType.CHANNEL_POST, handle_channel_post))
+bot_app.add_handler(MessageHandler(filters.UpdateType.EDITED_CHANNEL_POST, handle_edited_post))
+bot_app.add_handler(ChatMemberHandler(handle_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
 
 # 🔧 FastAPI app
-telegram_bot = Bot(token=TOKEN)
 app = FastAPI()
+ingestor = UpdateIngestor(bot_app)
+
+# 🧩 Updates repassados por outro worker (modo particionado) entram direto na fila local
+async def receive_handoff(data: dict):
+    update = Update.de_json(data, bot_app.bot)
+    if update and partition_key(update) is None:
+        # só posts e status de canais são particionados; qualquer outro tipo aqui é suspeito
+        logger.warning("🧩 Update %s repassado sem chave de partição, descartado", update.update_id)
+        return
+    if update:
+        # quem repassou já respondeu 200 ao Telegram: com a faixa cheia, espera em vez de descartar
+        # (a leitura do socket para enquanto isso, e o remetente sente a pressão no drain)
+        while not await ingestor.put(update):
+            pass
+
+partitioner = Partitioner(receive_handoff, routing.rebuild)
+poller = UpdatePoller(bot, ingestor, prefetch=prefetch_batch, allowed_updates=ALLOWED_UPDATES)
+routing.subscribe(partitioner.broadcast_routing_change)
+
+async def ensure_webhook(force: bool = False):
+    """
+    set_webhook substitui o registro anterior sem janela sem webhook (não há delete_webhook).
+    O secret não aparece em getWebhookInfo: se ele mudar, o primeiro 403 no /webhook força o registro.
+    """
+    if WEBHOOK_REGISTRATION == "off" and not force:
+        return
+    try:
+        if WEBHOOK_REGISTRATION == "auto" and not force:
+            info = await bot.get_webhook_info()
+            if info.url == WEBHOOK_URL and set(info.allowed_updates or ()) == set(ALLOWED_UPDATES):
+                logger.info("✅ Webhook já registrado")
+                return
+        await bot.set_webhook(url=WEBHOOK_URL, allowed_updates=ALLOWED_UPDATES, secret_token=WEBHOOK_SECRET)
+        logger.info("✅ Webhook registrado!")
+    except Exception as e:
+        logger.error("Erro ao registrar webhook: %s", e)
+
+async def warmup():
+    """Carrega o índice de rotas (com novas tentativas) e aquece caches, sem segurar o boot."""
+    while True:
+        try:
+            await routing.rebuild()
+            break
+        except Exception as e:
+            logger.error("Erro ao carregar índice de rotas: %s", e)
+            await asyncio.sleep(5)
+    asyncio.create_task(routing.refresh_loop())
+    # quarentenas feitas ou desfeitas em outro processo (worker de entregas, outros workers web)
+    asyncio.create_task(health.refresh_loop(HEALTH_REFRESH_INTERVAL))
+    try:
+        await warm_caches()
+    except Exception as e:
+        logger.error("Erro ao aquecer caches: %s", e)
 
 @app.on_event("startup")
 async def startup():
+    started = time.perf_counter()
     logger.info("🔧 Inicializando bot...")
-    await bot_app.initialize()
-    await telegram_bot.delete_webhook()
-    await telegram_bot.set_webhook(
-        url=WEBHOOK_URL,
-        allowed_updates=["message", "channel_post", "callback_query"]
-    )
-    logger.info("✅ Webhook pronto!")
+    # getMe e a checagem do esquema em paralelo; o resto roda em segundo plano
+    await asyncio.gather(bot_app.initialize(), asyncio.to_thread(migrations.init_schema))
+    ingestor.start()
+    ledger.start(prune=DELIVERY_MODE == "inline")  # em modo queue quem limpa é o worker de entregas
+    asyncio.create_task(warmup())
+    await partitioner.start()
+    if UPDATE_MODE == "polling":
+        await poller.start()
+    else:
+        asyncio.create_task(ensure_webhook())
+    logger.info("✅ Pronto em %.2fs", time.perf_counter() - started)
 
+@app.on_event("shutdown")
+async def shutdown():
+    await poller.stop()
+    await partitioner.stop()
+    await ingestor.stop()
+    await ledger.stop()
+    await bot_app.shutdown()
+
+_secret_resync = False
+
+# ⚡ Valida, enfileira e responde na hora; o processamento acontece no pool do ingestor
 @app.post("/webhook")
 async def webhook(request: Request):
-    update = Update.de_json(await request.json(), bot_app.bot)
-    await bot_app.process_update(update)
+    if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        global _secret_resync
+        if WEBHOOK_REGISTRATION == "auto" and not _secret_resync:
+            _secret_resync = True  # uma vez por processo: o registro pode ter um secret antigo
+            asyncio.create_task(ensure_webhook(force=True))
+        return JSONResponse({"ok": False}, status_code=403)
+    try:
+        data = await request.json()
+        update = Update.de_json(data, bot_app.bot)
+    except Exception:
+        update = None
+    if not update or not update.update_id:
+        return JSONResponse({"ok": False}, status_code=400)
+    if partitioner.enabled:
+        key = partition_key(update)
+        if key is not None and not partitioner.is_local(key) and await partitioner.handoff(key, data):
+            return {"ok": True}
+    if not await ingestor.put(update):
+        return JSONResponse({"ok": False}, status_code=503)
     return {"ok": True}
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+# 🔬 Profiler por amostragem sob demanda: GET /debug/profile?seconds=10 com o header X-Profile-Token
+@app.get("/debug/profile")
+async def profile_endpoint(request: Request, seconds: float = 10):
+    if not tracing.PROFILE_TOKEN:
+        return JSONResponse({"ok": False}, status_code=404)
+    if request.headers.get("X-Profile-Token") != tracing.PROFILE_TOKEN:
+        return JSONResponse({"ok": False}, status_code=403)
+    try:
+        stacks = await asyncio.to_thread(tracing.profiler.run, seconds)
+    except RuntimeError as e:
+        return JSONResponse({"ok": False, "description": str(e)}, status_code=409)
+    return Response(stacks, media_type="text/plain")
+
 @app.get("/")
 async def root():
     return {"status": "Bot ativo"}
@@ -0,0 +1,85 @@
+import os, time, logging
+import httpx
+from telegram.ext import ExtBot
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 🌐 Um único cliente do Bot API por processo: webhook, handlers e entregas dividem o mesmo pool
+API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")  # troque para um Bot API local/falso
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "256"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "60"))               # segundos de conexão ociosa no pool
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "10"))
+HTTP_MEDIA_WRITE_TIMEOUT = float(os.getenv("HTTP_MEDIA_WRITE_TIMEOUT", "30"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))          # espera máxima por conexão livre
+HTTP2 = os.getenv("HTTP2", "off") == "on"                               # exige httpx[http2]
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning("⚠️ HTTP2=on, mas o pacote h2 não está instalado; usando HTTP/1.1")
+        return False
+    return True
+
+class PoolTransport(httpx.AsyncBaseTransport):
+    """
+    Transporte httpx que mede quanto cada chamada esperou por uma conexão do pool
+    e se a conexão foi reaproveitada (keep-alive) ou aberta na hora.
+    Usa a extensão "trace" do httpcore: a primeira conexão TCP ou o envio dos
+    headers marca o fim da espera.
+    """
+
+    def __init__(self, **kwargs):
+        self._inner = httpx.AsyncHTTPTransport(**kwargs)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        state = {"waited": None, "new": False}
+
+        async def trace(event: str, info: dict):
+            if state["waited"] is None and event.endswith(("connect_tcp.started", "send_request_headers.started")):
+                state["waited"] = time.perf_counter() - start
+            if event == "connection.connect_tcp.started":
+                state["new"] = True
+
+        request.extensions = {**request.extensions, "trace": trace}
+        try:
+            return await self._inner.handle_async_request(request)
+        except httpx.PoolTimeout:
+            metrics.HTTP_POOL_WAIT.observe(time.perf_counter() - start)
+            metrics.HTTP_CONNECTIONS.labels("pool_timeout").inc()
+            raise
+        finally:
+            if state["waited"] is not None:
+                metrics.HTTP_POOL_WAIT.observe(state["waited"])
+                metrics.HTTP_CONNECTIONS.labels("new" if state["new"] else "reused").inc()
+
+    async def aclose(self):
+        await self._inner.aclose()
+
+def build_request(pool_size: int = HTTP_POOL_SIZE, read_timeout: float = HTTP_READ_TIMEOUT) -> metrics.InstrumentedRequest:
+    http2 = HTTP2 and _http2_available()
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                          keepalive_expiry=HTTP_KEEPALIVE)
+    return metrics.InstrumentedRequest(
+        connection_pool_size=pool_size,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=read_timeout,
+        write_timeout=HTTP_WRITE_TIMEOUT,
+        media_write_timeout=HTTP_MEDIA_WRITE_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version="2" if http2 else "1.1",
+        # com transport próprio o httpx ignora limits/http2 do cliente: vão direto para o transporte
+        httpx_kwargs={"transport": PoolTransport(limits=limits, http1=True, http2=http2)},
+    )
+
+# getUpdates fica num pool separado: o long polling prende a conexão por até `timeout` segundos
+bot = ExtBot(
+    token=os.getenv("TELEGRAM_TOKEN"),
+    base_url=API_URL,
+    request=build_request(),
+    get_updates_request=build_request(pool_size=1, read_timeout=HTTP_READ_TIMEOUT + 60),
+)
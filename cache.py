@@ -0,0 +1,98 @@
+import time, asyncio, logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class TTLCache:
+    """
+    Cache em memória com expiração por tempo e limite de tamanho (LRU).
+    Entradas vencidas continuam disponíveis via peek() até serem substituídas ou despejadas.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: OrderedDict = OrderedDict()  # chave -> (expira_em, valor)
+
+    def peek(self, key):
+        """Retorna (valor, fresco) sem alterar a ordem LRU; (None, False) se ausente."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None, False
+        return entry[1], entry[0] > time.monotonic()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return default
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value, ttl: float | None = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+class SWRCache:
+    """
+    Cache stale-while-revalidate para valores buscados por chave (ex: inscritos de um canal).
+    Valor fresco: devolvido direto. Vencido há menos de stale_ttl: devolvido e
+    atualizado em segundo plano. Ausente: buscado agora, em paralelo e limitado
+    por `concurrency`. Falhas de busca não são cacheadas.
+    """
+
+    def __init__(self, ttl: float, stale_ttl: float, concurrency: int = 10, max_size: int = 10_000):
+        self.stale_ttl = stale_ttl
+        self._cache = TTLCache(ttl, max_size)  # chave -> (valor, buscado_em)
+        self._sem = asyncio.Semaphore(concurrency)
+        self._refreshing: set = set()
+
+    def invalidate(self, key):
+        self._cache.pop(key)
+
+    async def get_many(self, keys, fetch) -> dict:
+        """Devolve {chave: valor} para as chaves que puderam ser resolvidas; fetch(chave) é uma corrotina."""
+        result, missing = {}, []
+        now = time.monotonic()
+        for key in keys:
+            entry, fresh = self._cache.peek(key)
+            if entry is not None and (fresh or now - entry[1] < self._cache.ttl + self.stale_ttl):
+                result[key] = entry[0]
+                if not fresh:
+                    self._refresh(key, fetch)
+            else:
+                missing.append(key)
+        values = await asyncio.gather(*(self._load(key, fetch) for key in missing))
+        result.update((k, v) for k, v in zip(missing, values) if v is not None)
+        return result
+
+    async def _load(self, key, fetch):
+        async with self._sem:
+            try:
+                value = await fetch(key)
+            except Exception as e:
+                logger.warning("Falha ao buscar %s: %s", key, e)
+                return None
+        self._cache.set(key, (value, time.monotonic()))
+        return value
+
+    def _refresh(self, key, fetch):
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        task = asyncio.create_task(self._load(key, fetch))
+        task.add_done_callback(lambda _: self._refreshing.discard(key))
@@ -1,19 +1,49 @@
-import os
-from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Boolean, ForeignKey
+import os, time, asyncio, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from sqlalchemy import (
+    create_engine, event, select, update, func,
+    Column, Integer, BigInteger, String, Boolean, Text, DateTime, ForeignKey, Index, text
+)
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
+import metrics, tracing
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# SQLite serve para testes locais; em produção é Postgres com SSL
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"sslmode": "require"},
+    connect_args={"check_same_thread": False} if IS_SQLITE else {"sslmode": "require"},
     pool_pre_ping=True,       # ✅ Verifica conexão antes de usar
     pool_recycle=1800         # ✅ Recicla conexões a cada 30 minutos
 )
 
-Session = sessionmaker(bind=engine)
+# 📈 Contagem e duração de cada comando SQL
+@event.listens_for(engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop()
+    elapsed = time.perf_counter() - start
+    kind = statement.lstrip().split(None, 1)[0].lower()
+    kind = kind if kind in ("select", "insert", "update", "delete") else "other"
+    metrics.DB_QUERIES.labels(kind).inc()
+    metrics.DB_SECONDS.labels(kind).observe(elapsed)
+    if tracing.current() is not None:
+        tracing.record("db", start, sql=" ".join(statement.split())[:120])
+
+# ✅ expire_on_commit=False: objetos continuam legíveis depois que a sessão fecha
+Session = sessionmaker(bind=engine, expire_on_commit=False)
 Base = declarative_base()
 
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(BigInteger, primary_key=True)
@@ -22,19 +52,24 @@ class User(Base):
 class Channel(Base):
     __tablename__ = "channels"
     id = Column(BigInteger, primary_key=True)
-    owner_id = Column(BigInteger, ForeignKey("users.id"))
-    username = Column(String)
+    owner_id = Column(BigInteger, ForeignKey("users.id"), index=True)
+    username = Column(String, index=True)
     title = Column(String)
     authenticated = Column(Boolean, default=False)
     owner = relationship("User", foreign_keys=[owner_id])
+    # convites em lote procuram por lower(username): sem este índice seria varredura completa
+    __table_args__ = (Index("ix_channels_username_lower", func.lower(username)),)
 
 class Group(Base):
     __tablename__ = "groups"
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    owner_id = Column(BigInteger, ForeignKey("users.id"))
+    owner_id = Column(BigInteger, ForeignKey("users.id"), index=True)
     owner = relationship("User", foreign_keys=[owner_id])
+    # canais aceitos, mantido por sync_member_counts: a tela "explorar" ordena por ele sem agregar
+    member_count = Column(Integer, nullable=False, default=0, server_default=text("0"))
     channels = relationship("GroupChannel", back_populates="group")
+    __table_args__ = (Index("ix_groups_member_count_id", "member_count", "id"),)
 
 class GroupChannel(Base):
     __tablename__ = "group_channels"
@@ -43,8 +78,102 @@ class GroupChannel(Base):
     channel_id = Column(BigInteger, ForeignKey("channels.id"))
     inviter_id = Column(BigInteger, ForeignKey("users.id"), nullable=True)
     accepted = Column(Boolean, default=None)
+    active = Column(Boolean, default=True, server_default=text("true"), nullable=False)  # False = em quarentena
     group = relationship("Group", back_populates="channels")
     channel = relationship("Channel")
     inviter = relationship("User", foreign_keys=[inviter_id])
+    # bancos já existentes recebem estes índices via migrations.py
+    __table_args__ = (
+        Index("uq_group_channels_group_channel", "group_id", "channel_id", unique=True),
+        Index("ix_group_channels_channel_accepted", "channel_id",
+              postgresql_where=text("accepted"), sqlite_where=text("accepted")),
+    )
+
+def sync_member_counts(conn, group_ids):
+    """Reconta groups.member_count dos grupos dados (conn: Session ou Connection, na mesma transação)."""
+    if not group_ids:
+        return
+    accepted = (select(func.count(GroupChannel.id))
+                .where(GroupChannel.group_id == Group.id, GroupChannel.accepted.is_(True))
+                .scalar_subquery())
+    conn.execute(update(Group).where(Group.id.in_(list(group_ids))).values(member_count=accepted)
+                 .execution_options(synchronize_session=False))
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(sess, flush_context):
+    # vínculos criados, aceitos ou apagados pelo ORM; delete() em massa chama sync_member_counts por conta própria
+    gids = {obj.group_id for obj in (*sess.new, *sess.dirty, *sess.deleted) if isinstance(obj, GroupChannel)}
+    sync_member_counts(sess.connection(), gids)
+
+class ConversationState(Base):
+    """Estado de conversa compartilhado entre workers (STATE_BACKEND=db)."""
+    __tablename__ = "conversation_states"
+    user_id = Column(BigInteger, primary_key=True)
+    data = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+class WorkerNode(Base):
+    """Worker vivo no modo particionado (PARTITION_MODE=on) e o endereço do seu canal interno."""
+    __tablename__ = "workers"
+    id = Column(String, primary_key=True)
+    address = Column(String, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+class Replica(Base):
+    """Ledger de replicação: qual mensagem de destino veio de qual post de origem."""
+    __tablename__ = "replicas"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    src_chat_id = Column(BigInteger, nullable=False)
+    src_msg_id = Column(BigInteger, nullable=False)
+    dst_chat_id = Column(BigInteger, nullable=False)
+    dst_msg_id = Column(BigInteger, nullable=False)
+    created_at = Column(DateTime, default=utcnow, nullable=False, index=True)
+    __table_args__ = (Index("ix_replicas_source", "src_chat_id", "src_msg_id"),)
+
+class DeliveryJob(Base):
+    """Envio pendente para um canal de destino (fila persistente consumida por queue_worker)."""
+    __tablename__ = "delivery_jobs"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    dest_chat_id = Column(BigInteger, nullable=False)
+    src_chat_id = Column(BigInteger)
+    payload = Column(Text, nullable=False)
+    status = Column(String, default="pending", nullable=False)  # pending, running, dead
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=utcnow, nullable=False)
+    locked_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=utcnow)
+    __table_args__ = (Index("ix_delivery_jobs_claim", "status", "next_attempt_at"),)
+
+# 🧵 Acesso ao banco fora do event loop
+# psycopg2 é bloqueante: toda consulta roda num pool de threads limitado,
+# do mesmo tamanho do pool de conexões, para não travar os outros updates.
+DB_THREADS = int(os.getenv("DB_THREADS", "5"))
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+@contextmanager
+def session_scope():
+    """Sessão com escopo de uma unidade de trabalho: commit no fim, rollback em erro, sempre fechada."""
+    sess = Session()
+    try:
+        yield sess
+        sess.commit()
+    except Exception:
+        sess.rollback()
+        raise
+    finally:
+        sess.close()
 
-Base.metadata.create_all(engine)
+async def run_db(fn, *args):
+    """Executa fn(sess, *args) numa thread do pool com uma sessão própria e devolve o resultado."""
+    def job():
+        with session_scope() as sess:
+            start = time.perf_counter()
+            sess.connection()  # checkout do pool
+            metrics.DB_POOL_WAIT.observe(time.perf_counter() - start)
+            tracing.record("pool", start)
+            return fn(sess, *args)
+    # copy_context: os comandos SQL rodam na thread, mas entram no trace do update
+    with tracing.span("run_db", fn=getattr(fn, "__name__", "?")):
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(_executor, ctx.run, job)
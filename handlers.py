@@ -1,14 +1,73 @@
-import re, logging, asyncio
-from collections import defaultdict
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message
+import os, re, time, random, logging, asyncio
+from collections import OrderedDict
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
 from telegram.ext import ContextTypes
 from telegram.error import BadRequest, Forbidden
-from db import Session, User, Channel, Group, GroupChannel
-from queue_worker import forward
+from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import joinedload
+from db import run_db, sync_member_counts, User, Channel, Group, GroupChannel
+from queue_worker import deliver, deliver_album, scheduler, health, DELIVERY_MODE
+from health import DestinationUnavailable
+from ledger import ledger
+from routing import routing
+from cache import TTLCache, SWRCache
+from albums import AlbumAggregator
+from payloads import AlbumPayload, copy_payload, album_part
+from ingest import release_turn
+import state_store
+import metrics
+import tracing
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
-user_states: dict[int, dict] = {}
+user_states = state_store.from_env()
+
+# 🔐 Canais já autenticados: canal -> (dono, username, título)
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "3600"))
+auth_cache = TTLCache(ttl=AUTH_CACHE_TTL)
+
+async def warm_caches():
+    """Preenche o cache de autenticação com os canais conhecidos, com expiração espalhada."""
+    rows = await run_db(lambda sess: sess.query(Channel.id, Channel.owner_id, Channel.username, Channel.title)
+                        .filter_by(authenticated=True).all())
+    for cid, owner_id, username, title in rows:
+        auth_cache.set(cid, (owner_id, username or "", title or ""), ttl=AUTH_CACHE_TTL * random.uniform(0.5, 1))
+    logger.info("🔥 Cache de autenticação aquecido: %d canais", len(rows))
+
+# 👥 Inscritos por canal (tela "ver grupo")
+subscriber_counts = SWRCache(
+    ttl=int(os.getenv("SUBS_CACHE_TTL", "600")),
+    stale_ttl=int(os.getenv("SUBS_CACHE_STALE", "86400")),
+    concurrency=int(os.getenv("SUBS_FETCH_CONCURRENCY", "10"))
+)
+
+# 🗂 Telas de gerenciamento já renderizadas: ("grupo"|"remover", gid) ou ("sair", canal) -> (texto, teclado)
+MENU_CACHE_TTL = int(os.getenv("MENU_CACHE_TTL", "300"))
+menu_views = TTLCache(ttl=MENU_CACHE_TTL)
+
+def _invalidate_views(group_id, channel_id):
+    """Chamado pelo índice de rotas a cada mudança de participação; (None, None) = tudo."""
+    if group_id is None and channel_id is None:
+        menu_views.clear()
+        return
+    if group_id is not None:
+        menu_views.pop(("grupo", group_id))
+        menu_views.pop(("remover", group_id))
+    if channel_id is not None:
+        menu_views.pop(("sair", channel_id))
+
+routing.watch(_invalidate_views)
+
+def _group_view(sess, gid: int):
+    """Grupo e seus canais aceitos [(canal, ativo)] numa única consulta com joinedload."""
+    g = (sess.query(Group)
+         .options(joinedload(Group.channels).joinedload(GroupChannel.channel))
+         .filter(Group.id == gid)
+         .one_or_none())
+    if g is None:
+        return None, []
+    return g, [(gc.channel, gc.active) for gc in g.channels if gc.accepted and gc.channel]
 
 def safe_edit(q, text, markup=None):
     try:
@@ -23,9 +82,22 @@ async def channel_authenticate(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     msg = update.channel_post
     if not msg or msg.chat.type != "channel":
         return
-    sess = Session()
+    # só reverifica o criador quando a entrada venceu ou o canal é desconhecido
+    cached, fresh = auth_cache.peek(msg.chat.id)
+    if fresh:
+        return
+    # posts do mesmo canal chegando juntos esperam a mesma checagem em vez de repeti-la
+    task = _auth_inflight.get(msg.chat.id)
+    if task is None:
+        task = _auth_inflight[msg.chat.id] = asyncio.create_task(_authenticate(ctx.bot, msg, cached))
+        task.add_done_callback(lambda t, cid=msg.chat.id: _auth_inflight.pop(cid, None))
+    await asyncio.shield(task)
+
+_auth_inflight: dict[int, asyncio.Task] = {}
+
+async def _authenticate(bot, msg, cached):
     try:
-        admins = await ctx.bot.get_chat_administrators(msg.chat.id)
+        admins = await bot.get_chat_administrators(msg.chat.id)
         creator = next((a.user for a in admins if a.status == "creator" and not a.user.is_bot), None)
         if not creator:
             logger.warning("Canal %s sem criador válido", msg.chat.id)
@@ -34,31 +106,61 @@ async def channel_authenticate(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         logger.error("Erro ao obter admins do canal %s: %s", msg.chat.id, e)
         return
 
-    sess.merge(User(id=creator.id, username=creator.username or ""))
-    canal = sess.get(Channel, msg.chat.id)
-    if not canal:
-        canal = Channel(
-            id=msg.chat.id,
-            owner_id=creator.id,
-            username=msg.chat.username or "",
-            title=msg.chat.title or "",
-            authenticated=True
-        )
-        sess.add(canal)
-    else:
-        canal.owner_id = creator.id
-        canal.authenticated = True
-    sess.commit()
+    entry = (creator.id, msg.chat.username or "", msg.chat.title or "")
+    if entry == cached:
+        auth_cache.set(msg.chat.id, entry)
+        return
+    if cached and cached[1:] != entry[1:]:
+        menu_views.clear()  # título/link aparecem nas telas de gerenciamento
+
+    def _save(sess):
+        # grava apenas o que mudou
+        user = sess.get(User, creator.id)
+        if not user:
+            sess.add(User(id=creator.id, username=creator.username or ""))
+        elif user.username != (creator.username or ""):
+            user.username = creator.username or ""
+        canal = sess.get(Channel, msg.chat.id)
+        if not canal:
+            sess.add(Channel(
+                id=msg.chat.id,
+                owner_id=creator.id,
+                username=msg.chat.username or "",
+                title=msg.chat.title or "",
+                authenticated=True
+            ))
+        else:
+            if canal.owner_id != creator.id or not canal.authenticated:
+                canal.owner_id = creator.id
+                canal.authenticated = True
+            if canal.username != entry[1] or canal.title != entry[2]:
+                canal.username, canal.title = entry[1], entry[2]  # renomeado ou trocou o @
+    await run_db(_save)
+    auth_cache.set(msg.chat.id, entry)
     logger.info("✅ Canal autenticado: %s (%s)", msg.chat.title, msg.chat.id)
 
+# 🔄 Mudança de status do bot num canal: força nova autenticação
+async def handle_my_chat_member(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    change = update.my_chat_member
+    if not change:
+        return
+    auth_cache.pop(change.chat.id)
+    logger.info("🔄 Status do bot no chat %s: %s", change.chat.id, change.new_chat_member.status)
+    if change.chat.type == "channel" and change.new_chat_member.status in ("administrator", "creator"):
+        await health.reactivate(change.chat.id)
+
 # 2️⃣ Menu /start
 async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    sess = Session()
-    sess.merge(User(id=uid, username=update.effective_user.username or ""))
-    sess.commit()
-    owns = sess.query(Group).filter_by(owner_id=uid).count() > 0
-    participates = sess.query(GroupChannel).filter_by(channel_id=uid, accepted=True).count() > 0
+    username = update.effective_user.username or ""
+
+    def _load(sess):
+        sess.merge(User(id=uid, username=username))
+        sess.flush()
+        owns = sess.query(Group).filter_by(owner_id=uid).count() > 0
+        participates = sess.query(GroupChannel).filter_by(channel_id=uid, accepted=True).count() > 0
+        return owns, participates
+    owns, participates = await run_db(_load)
 
     buttons = []
     if owns:
@@ -79,7 +181,7 @@ async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     else:
         await update.callback_query.answer()
         await safe_edit(update.callback_query, text, markup)
-    user_states.pop(uid, None)
+    await user_states.pop(uid)
 
 # 3️⃣ Menu de ajuda
 async def menu_ajuda(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -88,7 +190,7 @@ async def menu_ajuda(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         "👋 *Ajuda do Bot de Grupos de Canais*\n\n"
         "• /start ou ❓ Ajuda: este menu\n"
         "• Criar um grupo para adicionar canais\n"
-        "• Convidar canais via @username ou link\n"
+        "• Convidar canais via @username ou link (vários de uma vez)\n"
         "• Explorar e solicitar entrada em grupos públicos\n"
         "• Remover canais ou apagar grupos\n"
         "• Sair de grupo (se seu canal participa)\n"
@@ -102,99 +204,143 @@ async def menu_ajuda(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def menu_criar_grupo(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     uid = update.callback_query.from_user.id
-    user_states[uid] = {"state": "awaiting_group_name"}
+    await user_states.set(uid, {"state": "awaiting_group_name"})
     await safe_edit(update.callback_query, "📌 Digite o nome do novo grupo:",
                     InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Cancelar", callback_data="start")]]))
 
 # 5️⃣ Processar texto (criação ou convite)
+INVITE_RE = re.compile(r"(?:@|t\.me/)(\w+)")
+INVITE_MAX = int(os.getenv("INVITE_MAX", "100"))                          # canais por mensagem
+INVITE_CONCURRENCY = int(os.getenv("INVITE_CONCURRENCY", "10"))           # get_chat simultâneos
+INVITE_MISS_TTL = int(os.getenv("INVITE_MISS_TTL", "600"))                # usernames inexistentes
+# username -> (canal, título, dono) ou o motivo da falha (str), para não repetir get_chat
+username_cache = TTLCache(ttl=AUTH_CACHE_TTL)
+
+async def _resolve_username(bot, username: str, sem: asyncio.Semaphore):
+    """(canal, título, dono) pelo Bot API, ou o motivo da falha; só falhas definitivas ficam no cache."""
+    async with sem:
+        try:
+            chat = await bot.get_chat(f"@{username}")
+            if chat.type != "channel":
+                found = "não é um canal"
+            else:
+                try:
+                    admins = await bot.get_chat_administrators(chat.id)
+                    owner = next((a.user.id for a in admins if a.status == "creator"), None)
+                except Exception:
+                    owner = None
+                found = (chat.id, chat.title or username, owner)
+        except Forbidden:
+            return "bot sem permissão no canal"
+        except BadRequest as e:
+            found = f"não encontrado ({e.message})"
+        except Exception as e:
+            logger.error("Erro ao resolver @%s: %s", username, e)
+            return f"erro inesperado ({e})"
+    username_cache.set(username.lower(), found, ttl=INVITE_MISS_TTL if isinstance(found, str) else None)
+    return found
+
+async def _resolve_channels(bot, usernames: list[str]):
+    """
+    Resolve vários usernames: primeiro o banco (uma consulta), depois o cache,
+    e o resto em paralelo no Bot API, limitado por INVITE_CONCURRENCY.
+    Devolve ({username: (canal, título, dono, novo)}, {username: motivo}).
+    """
+    known = await run_db(lambda sess: sess.query(Channel.username, Channel.id, Channel.title, Channel.owner_id)
+                         .filter(func.lower(Channel.username).in_([u.lower() for u in usernames])).all())
+    known = {name.lower(): (cid, title, owner, False) for name, cid, title, owner in known}
+    resolved, failed, pending = {}, {}, []
+    for username in usernames:
+        if username.lower() in known:
+            resolved[username] = known[username.lower()]
+            continue
+        cached = username_cache.get(username.lower())
+        if cached is None:
+            pending.append(username)
+        elif isinstance(cached, str):
+            failed[username] = cached
+        else:
+            resolved[username] = (*cached, True)
+    if pending:
+        sem = asyncio.Semaphore(INVITE_CONCURRENCY)
+        results = await asyncio.gather(*(_resolve_username(bot, u, sem) for u in pending))
+        for username, found in zip(pending, results):
+            if isinstance(found, str):
+                failed[username] = found
+            else:
+                resolved[username] = (*found, True)
+    return resolved, failed
+
+def _invite_many(sess, gid: int, uid: int, resolved: dict):
+    """Grava canais novos e convites numa única transação. Devolve (adicionados, convidados, já no grupo)."""
+    ids = {cid for cid, _, _, _ in resolved.values()}
+    stored = {cid for (cid,) in sess.query(Channel.id).filter(Channel.id.in_(ids))}
+    present = {cid for (cid,) in sess.query(GroupChannel.channel_id)
+               .filter(GroupChannel.group_id == gid, GroupChannel.channel_id.in_(ids))}
+    added, invited, already = [], [], []
+    for username, (cid, title, owner, new) in resolved.items():
+        if new and cid not in stored:
+            sess.add(Channel(id=cid, owner_id=owner, username=username, title=title, authenticated=False))
+            stored.add(cid)
+        if cid in present:
+            already.append(cid)
+            continue
+        present.add(cid)
+        is_owner = owner == uid
+        sess.add(GroupChannel(group_id=gid, channel_id=cid, inviter_id=uid, accepted=True if is_owner else None))
+        (added if is_owner else invited).append(cid)
+    return added, invited, already
+
+def _invite_summary(resolved: dict, added, invited, already, failed: dict) -> str:
+    names = {cid: f"@{username}" for username, (cid, _, _, _) in resolved.items()}
+    lines = []
+    for icon, label, ids in (("✅", "Adicionados automaticamente", added),
+                             ("📨", "Convites enviados (o canal precisa aceitar)", invited),
+                             ("⚠️", "Já convidados ou adicionados", already)):
+        if ids:
+            lines.append(f"{icon} {label} ({len(ids)}): " + ", ".join(names[cid] for cid in ids))
+    if failed:
+        lines.append(f"❌ Falharam ({len(failed)}): " + ", ".join(f"@{u} — {why}" for u, why in failed.items()))
+    return "\n\n".join(lines)[:4096]
+
 async def handle_text_message(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
     uid = update.effective_user.id
     text = update.message.text.strip()
-    state = user_states.get(uid)
-    sess = Session()
+    state = await user_states.get(uid)
 
     # criar grupo
     if state and state.get("state") == "awaiting_group_name":
         name = text
-        sess.add(Group(name=name, owner_id=uid))
-        sess.commit()
+        await run_db(lambda sess: sess.add(Group(name=name, owner_id=uid)))
         await update.message.reply_text(f"✅ Grupo *{name}* criado!", parse_mode="Markdown")
-        user_states.pop(uid)
+        await user_states.pop(uid)
         return
 
-    # convite de canal
+    # convite de canal (um ou vários @username / links t.me na mesma mensagem)
     elif state and state.get("state") == "awaiting_channel_invite":
-        match = re.search(r"@([\w\d_]+)", text) or re.search(r"t\.me/([\w\d_]+)", text)
-        if not match:
-            await update.message.reply_text("❌ Envie um @username ou link t.me válido.")
+        usernames = {}
+        for name in INVITE_RE.findall(text):
+            usernames.setdefault(name.lower(), name)
+        usernames = list(usernames.values())[:INVITE_MAX]
+        if not usernames:
+            await update.message.reply_text("❌ Envie um ou mais @username ou links t.me válidos.")
             return
-        username = match.group(1)
-
-        existing = sess.query(Channel).filter_by(username=username).first()
-        if existing:
-            chat_id = existing.id
-            chat_title = existing.title
-            is_owner = (existing.owner_id == uid)
-        else:
-            try:
-                chat = await ctx.bot.get_chat(f"@{username}")
-                if chat.type != "channel":
-                    await update.message.reply_text("❌ Esse usuário não é um canal.")
-                    return
-                chat_id = chat.id
-                chat_title = chat.title or username
-                try:
-                    admins = await ctx.bot.get_chat_administrators(chat.id)
-                    owner = next((a.user for a in admins if a.status == "creator"), None)
-                except:
-                    owner = None
-                sess.merge(Channel(
-                    id=chat.id,
-                    owner_id=owner.id if owner else None,
-                    username=username,
-                    title=chat_title,
-                    authenticated=False
-                ))
-                is_owner = (owner and owner.id == uid)
-            except Forbidden:
-                await update.message.reply_text("❌ Bot não é admin ou não tem permissão no canal.")
-                return
-            except BadRequest as e:
-                await update.message.reply_text(f"❌ Canal não encontrado: {e.message}")
-                return
-            except Exception as e:
-                await update.message.reply_text(f"❌ Erro inesperado: {e}")
-                return
-
         gid = state["group_id"]
-        already = sess.query(GroupChannel).filter_by(group_id=gid, channel_id=chat_id).first()
-        if already:
-            await update.message.reply_text("⚠️ Este canal já foi convidado ou adicionado.")
-        else:
-            sess.add(GroupChannel(
-                group_id=gid,
-                channel_id=chat_id,
-                inviter_id=uid,
-                accepted=True if is_owner else None
-            ))
-            sess.commit()
-            if is_owner:
-                await update.message.reply_text("✅ Canal adicionado automaticamente ao grupo!")
-            else:
-                await update.message.reply_text(
-                    f"✅ Convite enviado ao canal *{chat_title}*! Agora ele precisa aceitar.",
-                    parse_mode="Markdown"
-                )
-        user_states.pop(uid)
+        resolved, failed = await _resolve_channels(ctx.bot, usernames)
+        added, invited, already = await run_db(_invite_many, gid, uid, resolved)
+        for cid in added:
+            routing.add(gid, cid)
+        await update.message.reply_text(_invite_summary(resolved, added, invited, already, failed))
+        if resolved:
+            await user_states.pop(uid)
 
 # 6️⃣ Meus canais
 async def menu_meus_canais(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     uid = update.callback_query.from_user.id
-    sess = Session()
-    chans = sess.query(Channel).filter_by(owner_id=uid).all()
+    chans = await run_db(lambda sess: sess.query(Channel).filter_by(owner_id=uid).all())
     if not chans:
         await safe_edit(update.callback_query,
                         "🚫 Você não tem canais autenticados.",
@@ -211,8 +357,7 @@ async def menu_meus_canais(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def menu_meus_grupos(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     uid = update.callback_query.from_user.id
-    sess = Session()
-    grps = sess.query(Group).filter_by(owner_id=uid).all()
+    grps = await run_db(lambda sess: sess.query(Group).filter_by(owner_id=uid).all())
     if not grps:
         await safe_edit(update.callback_query,
                         "🚫 Você ainda não criou nenhum grupo.",
@@ -223,37 +368,43 @@ async def menu_meus_grupos(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await safe_edit(update.callback_query, "📂 Seus grupos:", InlineKeyboardMarkup(kb))
 
 # 8️⃣ Gerenciar grupo (lista canais)
-async def gerenciar_grupo(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+async def gerenciar_grupo(update: Update, ctx: ContextTypes.DEFAULT_TYPE, gid: int | None = None):
     await update.callback_query.answer()
-    gid = int(update.callback_query.data.split("_", 1)[1])
-    sess = Session()
-    g = sess.get(Group, gid)
-    parts = sess.query(GroupChannel).filter_by(group_id=gid, accepted=True).all()
-
-    text = f"🎯 *{g.name}*\n\n📢 Canais participantes:"
-    if not parts:
-        text += "\n_Nenhum canal no grupo._"
-    else:
-        for gc in parts:
-            ch = sess.get(Channel, gc.channel_id)
-            link = f"https://t.me/{ch.username}" if ch.username else str(ch.id)
-            text += f"\n• [{ch.title}]({link})\n  ID: `{ch.id}`"
-
-    kb = [
-        [InlineKeyboardButton("➕ Convidar canal", callback_data=f"convite_{gid}")],
-        [InlineKeyboardButton("🗑 Remover canal", callback_data=f"remover_{gid}")],
-        [InlineKeyboardButton("🗑❌ Apagar grupo", callback_data=f"delete_{gid}")],
-        [InlineKeyboardButton("↩️ Voltar", callback_data="menu_meus_grupos")]
-    ]
-    await safe_edit(update.callback_query, text, InlineKeyboardMarkup(kb))
+    if gid is None:
+        gid = int(update.callback_query.data.split("_", 1)[1])
+
+    view = menu_views.get(("grupo", gid))
+    if view is None:
+        g, chans = await run_db(_group_view, gid)
+        if g is None:
+            await safe_edit(update.callback_query, "❌ Grupo não encontrado.",
+                            InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Voltar", callback_data="menu_meus_grupos")]]))
+            return
+        text = f"🎯 *{g.name}*\n\n📢 Canais participantes:"
+        if not chans:
+            text += "\n_Nenhum canal no grupo._"
+        else:
+            for ch, active in chans:
+                link = f"https://t.me/{ch.username}" if ch.username else str(ch.id)
+                text += f"\n• [{ch.title}]({link})" + ("" if active else " ⏸ _pausado_") + f"\n  ID: `{ch.id}`"
+
+        kb = [
+            [InlineKeyboardButton("➕ Convidar canal", callback_data=f"convite_{gid}")],
+            [InlineKeyboardButton("🗑 Remover canal", callback_data=f"remover_{gid}")],
+            [InlineKeyboardButton("🗑❌ Apagar grupo", callback_data=f"delete_{gid}")],
+            [InlineKeyboardButton("↩️ Voltar", callback_data="menu_meus_grupos")]
+        ]
+        view = text, InlineKeyboardMarkup(kb)
+        menu_views.set(("grupo", gid), view)
+    await safe_edit(update.callback_query, *view)
 
 # 9️⃣ Convidar canal (via texto)
 async def convite_manual(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     gid = int(update.callback_query.data.split("_", 1)[1])
-    user_states[update.callback_query.from_user.id] = {"state": "awaiting_channel_invite", "group_id": gid}
+    await user_states.set(update.callback_query.from_user.id, {"state": "awaiting_channel_invite", "group_id": gid})
     await safe_edit(update.callback_query,
-                    "📥 Envie @username ou link do canal:",
+                    "📥 Envie o @username ou link t.me do canal (ou vários, um por linha):",
                     InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Voltar", callback_data=f"gerenciar_{gid}")]]))
 
 # 🔟 Aceitar/Recusar convite interno
@@ -266,21 +417,29 @@ async def handle_convite_response(update: Update, ctx: ContextTypes.DEFAULT_TYPE
         return await update.callback_query.answer("❌ Callback inválido", show_alert=True)
     _, action, gid, cid = parts
     gid, cid = int(gid), int(cid)
-    sess = Session()
-    gc = sess.query(GroupChannel).filter_by(group_id=gid, channel_id=cid).first()
-    if not gc:
+
+    def _respond(sess):
+        gc = sess.query(GroupChannel).filter_by(group_id=gid, channel_id=cid).first()
+        if not gc:
+            return None
+        if action == "aceitar":
+            gc.accepted = True
+        else:
+            sess.delete(gc)
+        return sess.get(Channel, cid), sess.get(Group, gid)
+    found = await run_db(_respond)
+    if not found:
         await safe_edit(update.callback_query, "❌ Convite inválido.")
         return
-    ch = sess.get(Channel, cid)
-    g = sess.get(Group, gid)
+    ch, g = found
+    if action == "aceitar":
+        routing.add(gid, cid)
+    else:
+        routing.remove(gid, cid)
 
     if action == "aceitar":
-        gc.accepted = True
-        sess.commit()
         await safe_edit(update.callback_query, f"✅ Canal *{ch.title}* aceitou convite.")
     else:
-        sess.delete(gc)
-        sess.commit()
         await safe_edit(update.callback_query, f"❌ Canal *{ch.title}* recusou convite.")
 
     try:
@@ -292,21 +451,71 @@ async def handle_convite_response(update: Update, ctx: ContextTypes.DEFAULT_TYPE
     except Exception:
         logger.error("Erro ao notificar dono do grupo")
 
-# 1️⃣1️⃣ Explorar grupos públicos
+# 1️⃣1️⃣ Explorar grupos públicos (paginado por cursor)
+EXPLORE_PAGE_SIZE = int(os.getenv("EXPLORE_PAGE_SIZE", "10"))
+
+def _explore_page(sess, sort: str, direction: str, cursor: tuple | None, limit: int):
+    """
+    Uma página de (id, nome, canais aceitos) lida só da tabela groups, com keyset:
+    sort "i": por id; sort "s": por tamanho desc, cursor (member_count, id), pelo
+    índice (member_count, id). O custo da página não depende do total de grupos.
+    Retorna limit+1 linhas no máximo, já na ordem de exibição da direção pedida.
+    """
+    q = sess.query(Group.id, Group.name, Group.member_count)
+    forward = direction == "n"
+    if sort == "s":
+        if cursor:
+            c, i = cursor
+            if forward:
+                q = q.filter(or_(Group.member_count < c, and_(Group.member_count == c, Group.id < i)))
+            else:
+                q = q.filter(or_(Group.member_count > c, and_(Group.member_count == c, Group.id > i)))
+        order = ((Group.member_count.desc(), Group.id.desc()) if forward
+                 else (Group.member_count.asc(), Group.id.asc()))
+        return q.order_by(*order).limit(limit + 1).all()
+    if cursor:
+        q = q.filter(Group.id > cursor[0] if forward else Group.id < cursor[0])
+    return q.order_by(Group.id.asc() if forward else Group.id.desc()).limit(limit + 1).all()
+
+def _explore_cursor(sort: str, row) -> str:
+    return f"{row[2]}.{row[0]}" if sort == "s" else str(row[0])
+
 async def explorar_grupos(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    return await explorar_pagina(update, ctx, "i", "n", "")
+
+async def explorar_pagina(update: Update, ctx: ContextTypes.DEFAULT_TYPE,
+                          sort: str | None = None, direction: str | None = None, raw_cursor: str | None = None):
     await update.callback_query.answer()
-    sess = Session()
-    grps = sess.query(Group).all()
-    if not grps:
+    if sort is None:
+        # expl_<ordem>_<direção>_<cursor>
+        _, sort, direction, raw_cursor = update.callback_query.data.split("_", 3)
+    cursor = tuple(int(x) for x in raw_cursor.split(".")) if raw_cursor else None
+    rows = await run_db(_explore_page, sort, direction, cursor, EXPLORE_PAGE_SIZE)
+
+    more = len(rows) > EXPLORE_PAGE_SIZE
+    rows = rows[:EXPLORE_PAGE_SIZE]
+    if direction == "p":
+        rows.reverse()
+    if not rows and not cursor:
         await safe_edit(update.callback_query,
                         "🌍 Ainda não há grupos públicos.",
                         InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Voltar", callback_data="start")]]))
         return
-    kb = [
-        [InlineKeyboardButton(f"{g.name} ({sess.query(GroupChannel).filter_by(group_id=g.id,accepted=True).count()})",
-                              callback_data=f"vergrp_{g.id}")]
-        for g in grps
-    ]
+    has_prev = bool(cursor) if direction == "n" else more
+    has_next = more if direction == "n" else True
+
+    kb = [[InlineKeyboardButton(f"{name} ({count})", callback_data=f"vergrp_{gid}")] for gid, name, count in rows]
+    nav = []
+    if has_prev and rows:
+        nav.append(InlineKeyboardButton("⬅️ Anterior", callback_data=f"expl_{sort}_p_{_explore_cursor(sort, rows[0])}"))
+    if has_next and rows:
+        nav.append(InlineKeyboardButton("Próxima ➡️", callback_data=f"expl_{sort}_n_{_explore_cursor(sort, rows[-1])}"))
+    if nav:
+        kb.append(nav)
+    if sort == "s":
+        kb.append([InlineKeyboardButton("🔤 Ordenar por criação", callback_data="expl_i_n_")])
+    else:
+        kb.append([InlineKeyboardButton("📊 Ordenar por tamanho", callback_data="expl_s_n_")])
     kb.append([InlineKeyboardButton("↩️ Voltar", callback_data="start")])
     await safe_edit(update.callback_query, "🌐 Grupos públicos:", InlineKeyboardMarkup(kb))
 
@@ -314,16 +523,16 @@ async def explorar_grupos(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def ver_grupo(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     gid = int(update.callback_query.data.split("_", 1)[1])
-    sess = Session()
-    g = sess.get(Group, gid)
-    parts = sess.query(GroupChannel).filter_by(group_id=gid, accepted=True).all()
+
+    g, members = await run_db(_group_view, gid)
+    if g is None:
+        await safe_edit(update.callback_query, "❌ Grupo não encontrado.")
+        return
+    chans = [ch for ch, _ in members]
+    counts = await subscriber_counts.get_many([ch.id for ch in chans], ctx.bot.get_chat_member_count)
     text = f"📁 *{g.name}*\nCanais:"
-    for gc in parts:
-        ch = sess.get(Channel, gc.channel_id)
-        try:
-            subs = await ctx.bot.get_chat_members_count(ch.id)
-        except:
-            subs = "?"
+    for ch in chans:
+        subs = counts.get(ch.id, "?")
         link = f"https://t.me/{ch.username}" if ch.username else str(ch.id)
         text += f"\n- [{ch.title}]({link}) — {subs}"
     await safe_edit(update.callback_query, text,
@@ -337,17 +546,22 @@ async def solicitar_entrada(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     uid = update.callback_query.from_user.id
     gid = int(update.callback_query.data.split("_", 1)[1])
-    sess = Session()
-    if sess.query(GroupChannel).filter_by(group_id=gid, channel_id=uid).first():
+
+    def _request(sess):
+        if sess.query(GroupChannel).filter_by(group_id=gid, channel_id=uid).first():
+            return "duplicado", None, None
+        ch = sess.get(Channel, uid)
+        if not ch or not ch.authenticated:
+            return "sem_auth", None, None
+        sess.add(GroupChannel(group_id=gid, channel_id=uid, inviter_id=uid, accepted=None))
+        return "ok", ch, sess.get(Group, gid)
+    status, ch, g = await run_db(_request)
+    if status == "duplicado":
         await safe_edit(update.callback_query, "🚫 Já está no grupo ou já solicitou.")
         return
-    ch = sess.get(Channel, uid)
-    if not ch or not ch.authenticated:
+    if status == "sem_auth":
         await safe_edit(update.callback_query, "❌ Seu canal não está autenticado.")
         return
-    sess.add(GroupChannel(group_id=gid, channel_id=uid, inviter_id=uid, accepted=None))
-    sess.commit()
-    g = sess.get(Group, gid)
     try:
         await ctx.bot.send_message(
             g.owner_id,
@@ -369,24 +583,28 @@ async def handle_ext_response(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if len(parts) != 4:
         await update.callback_query.answer("⚠️ Callback inválido.", show_alert=True)
         return
-    _, action, gid, cid = parts
+    action, _, gid, cid = parts
     gid, cid = int(gid), int(cid)
-    sess = Session()
-    gc = sess.query(GroupChannel).filter_by(group_id=gid, channel_id=cid).first()
-    if not gc:
+
+    def _respond(sess):
+        gc = sess.query(GroupChannel).filter_by(group_id=gid, channel_id=cid).first()
+        if not gc:
+            return None
+        if action == "aceitar":
+            gc.accepted = True
+        else:
+            sess.delete(gc)
+        return sess.get(Group, gid)
+    g = await run_db(_respond)
+    if not g:
         await safe_edit(update.callback_query, "⚠️ Solicitação inválida.")
         return
-    ch = sess.get(Channel, cid)
-    g = sess.get(Group, gid)
 
-    if action == "aceitar_ext":
-        gc.accepted = True
-        sess.commit()
+    if action == "aceitar":
+        routing.add(gid, cid)
         await safe_edit(update.callback_query, "✅ Canal aceito no grupo.")
         msg = f"✅ Seu canal foi aceito no grupo *{g.name}*"
     else:
-        sess.delete(gc)
-        sess.commit()
         await safe_edit(update.callback_query, "❌ Solicitação recusada.")
         msg = f"❌ Seu canal foi recusado no grupo *{g.name}*"
     try:
@@ -398,27 +616,33 @@ async def handle_ext_response(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 async def remocao_canal(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     gid = int(update.callback_query.data.split("_", 1)[1])
-    sess = Session()
-    chans = sess.query(GroupChannel).filter_by(group_id=gid, accepted=True).all()
-    if not chans:
-        await safe_edit(update.callback_query,
-                        "🚫 Sem canais para remover.",
-                        InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Voltar", callback_data=f"gerenciar_{gid}")]]))
-        return
-    kb = [[InlineKeyboardButton(sess.get(Channel, gc.channel_id).title,
-                                callback_data=f"remover_confirm_{gid}_{gc.channel_id}")] for gc in chans]
-    kb.append([InlineKeyboardButton("↩️ Voltar", callback_data=f"gerenciar_{gid}")])
-    await safe_edit(update.callback_query, "Escolha canal para remover:", InlineKeyboardMarkup(kb))
+
+    view = menu_views.get(("remover", gid))
+    if view is None:
+        _, chans = await run_db(_group_view, gid)
+        back = [InlineKeyboardButton("↩️ Voltar", callback_data=f"gerenciar_{gid}")]
+        if not chans:
+            view = "🚫 Sem canais para remover.", InlineKeyboardMarkup([back])
+        else:
+            kb = [[InlineKeyboardButton(ch.title + ("" if active else " ⏸"), callback_data=f"remover_confirm_{gid}_{ch.id}")]
+                  for ch, active in chans]
+            kb.append(back)
+            view = "Escolha canal para remover:", InlineKeyboardMarkup(kb)
+        menu_views.set(("remover", gid), view)
+    await safe_edit(update.callback_query, *view)
 
 # 1️⃣6️⃣ Confirmar remoção
 async def remover_confirm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     _, _, gid, cid = update.callback_query.data.split("_")
     gid, cid = int(gid), int(cid)
-    sess = Session()
+    await run_db(_remove_member, gid, cid)
+    routing.remove(gid, cid)
+    return await gerenciar_grupo(update, ctx, gid)
+
+def _remove_member(sess, gid: int, cid: int):
     sess.query(GroupChannel).filter_by(group_id=gid, channel_id=cid).delete()
-    sess.commit()
-    return await gerenciar_grupo(update, ctx)
+    sync_member_counts(sess, [gid])  # delete em massa não passa pelo after_flush
 
 # 1️⃣7️⃣ Apagar grupo
 async def prompt_delete_group(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -433,93 +657,180 @@ async def prompt_delete_group(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
 
 async def delete_confirm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
-    gid = int(update.callback_query.data.split("_", 1)[1])
-    sess = Session()
-    sess.query(GroupChannel).filter_by(group_id=gid).delete()
-    sess.query(Group).filter_by(id=gid).delete()
-    sess.commit()
+    gid = int(update.callback_query.data.rsplit("_", 1)[1])
+
+    def _delete(sess):
+        sess.query(GroupChannel).filter_by(group_id=gid).delete()
+        sess.query(Group).filter_by(id=gid).delete()
+    await run_db(_delete)
+    routing.drop_group(gid)
     return await menu_meus_grupos(update, ctx)
 # 1️⃣8️⃣ Sair de grupo (canal participante)
 async def menu_sair_grupo(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     uid = update.callback_query.from_user.id
-    sess = Session()
-    chans = sess.query(GroupChannel).filter_by(channel_id=uid, accepted=True).all()
-    if not chans:
-        await safe_edit(update.callback_query,
-                        "🚫 Você não participa de nenhum grupo.",
-                        InlineKeyboardMarkup([[InlineKeyboardButton("↩️ Voltar", callback_data="start")]]))
-        return
-    kb = [[InlineKeyboardButton(sess.get(Group, gc.group_id).name,
-                                callback_data=f"sair_confirm_{gc.group_id}_{uid}")]
-          for gc in chans]
-    kb.append([InlineKeyboardButton("↩️ Voltar", callback_data="start")])
-    await safe_edit(update.callback_query, "Escolha o grupo para sair:", InlineKeyboardMarkup(kb))
+
+    view = menu_views.get(("sair", uid))
+    if view is None:
+        grps = await run_db(lambda sess: sess.query(Group)
+                            .join(GroupChannel, GroupChannel.group_id == Group.id)
+                            .filter(GroupChannel.channel_id == uid, GroupChannel.accepted == True)
+                            .all())
+        back = [InlineKeyboardButton("↩️ Voltar", callback_data="start")]
+        if not grps:
+            view = "🚫 Você não participa de nenhum grupo.", InlineKeyboardMarkup([back])
+        else:
+            kb = [[InlineKeyboardButton(g.name, callback_data=f"sair_confirm_{g.id}_{uid}")] for g in grps]
+            kb.append(back)
+            view = "Escolha o grupo para sair:", InlineKeyboardMarkup(kb)
+        menu_views.set(("sair", uid), view)
+    await safe_edit(update.callback_query, *view)
 
 async def sair_confirm(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     await update.callback_query.answer()
     _, _, gid, cid = update.callback_query.data.split("_")
-    sess = Session()
-    try:
-        sess.query(GroupChannel).filter_by(group_id=int(gid), channel_id=int(cid)).delete()
-        sess.commit()
-    finally:
-        sess.close()
+    gid, cid = int(gid), int(cid)
+    await run_db(_remove_member, gid, cid)
+    routing.remove(gid, cid)
     return await menu_sair_grupo(update, ctx)
 
 # 1️⃣9️⃣ Replicar posts entre canais (mensagens simples e álbuns)
-media_group_buffer: dict[str, list[Message]] = defaultdict(list)
-media_group_locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
-
 async def new_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     msg = update.channel_post
     if not msg:
         return
 
-    sess = Session()
-    gcs = sess.query(GroupChannel).filter_by(channel_id=msg.chat.id, accepted=True).all()
-    if not gcs:
+    # 🧭 Destinos vêm do índice em memória: nenhuma consulta ao banco por post
+    if not routing.ready.is_set():
+        await routing.ready.wait()  # boot: índice ainda carregando em segundo plano
+    destinos = routing.destinations(msg.chat.id)
+    if not destinos:
         return
 
-    # 🔁 Encaminhar álbuns (media_group)
+    # 🔁 Álbuns (media_group): o buffer guarda só a parte já preparada, não o Message
     if msg.media_group_id:
-        group_id = msg.media_group_id
-        lock = media_group_locks[group_id]
-
-        async with lock:
-            media_group_buffer[group_id].append(msg)
-            await asyncio.sleep(2.5)
-
-            album = sorted(media_group_buffer[group_id], key=lambda m: m.message_id)
-            del media_group_buffer[group_id]
-            del media_group_locks[group_id]
-
-            for gc in gcs:
-                grupo = sess.get(Group, gc.group_id)
-                if not grupo:
-                    continue
-                for destino in grupo.channels:
-                    if destino.accepted and destino.channel_id != msg.chat.id:
-                        for part in album:
-                            try:
-                                await forward(part.chat.id, destino.channel_id, part.message_id)
-                            except Exception as e:
-                                print(f"Erro ao encaminhar parte de álbum para {destino.channel_id}: {e}")
+        part = album_part(msg)
+        if part:
+            media_group_buffer.add((msg.chat.id, msg.media_group_id), part)
         return
 
-    # 🔁 Encaminhar mensagens individuais
-    for gc in gcs:
-        grupo = sess.get(Group, gc.group_id)
-        if not grupo:
-            continue
-        for destino in grupo.channels:
-            if destino.accepted and destino.channel_id != msg.chat.id:
-                try:
-                    await forward(msg.chat.id, destino.channel_id, msg.message_id)
-                except Exception as e:
-                    print(f"Erro ao encaminhar para {destino.channel_id}: {e}")
-                    
-# 2️⃣0️⃣ Central de callbacks
+    # 🔁 Encaminhar mensagens individuais (um payload para todos os destinos)
+    post = copy_payload(msg)
+    metrics.FANOUT_SIZE.observe(len(destinos))
+    with tracing.span("fanout", destinos=len(destinos)):
+        _log_failures(post.message_id, await deliver(post, destinos))
+    if DELIVERY_MODE != "queue":  # na fila, o JobRunner mede quando cada entrega termina
+        metrics.REPLICATION_SECONDS.observe(time.time() - post.date)
+
+async def _flush_album(key: tuple, parts: list):
+    chat_id, media_group_id = key
+    destinos = routing.destinations(chat_id)
+    metrics.ALBUM_PARTS.observe(len(parts))
+    if destinos:
+        album = AlbumPayload.build(chat_id, parts)
+        metrics.FANOUT_SIZE.observe(len(destinos))
+        # trace próprio: o álbum sai depois da janela de espera, fora do update que o abriu
+        with tracing.trace("album", parts=len(parts), buffered=f"{time.time() - album.date:.1f}s"):
+            _log_failures(media_group_id, await deliver_album(album, destinos))
+        if DELIVERY_MODE != "queue":
+            metrics.REPLICATION_SECONDS.observe(time.time() - album.date)
+
+def _log_failures(ref, results: dict):
+    for destino, result in results.items():
+        if isinstance(result, Exception) and not isinstance(result, DestinationUnavailable):
+            logger.error("Erro ao encaminhar %s para %s: %s", ref, destino, result)
+
+media_group_buffer = AlbumAggregator(_flush_album)
+metrics.ALBUMS_OPEN.set_function(lambda: len(media_group_buffer))
+
+# 2️⃣0️⃣ Propagar edições e exclusões para as réplicas (via ledger)
+# O Bot API não avisa quando um post é apagado: o dono responde ao post com /apagar no canal de origem.
+DELETE_COMMANDS = ("/apagar", "#apagar")
+
+def _is_delete_command(msg) -> bool:
+    return bool(msg.text and msg.text.strip().lower() in DELETE_COMMANDS and msg.reply_to_message)
+
+async def handle_edited_post(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    msg = update.edited_channel_post
+    if not msg:
+        return
+    replicas = await ledger.lookup(msg.chat.id, msg.message_id)
+    if not replicas:
+        return
+    if msg.text:
+        def edit(chat, mid):
+            return ctx.bot.edit_message_text(msg.text_html, chat_id=chat, message_id=mid, parse_mode=ParseMode.HTML)
+    else:
+        caption = msg.caption_html if msg.caption else None
+        def edit(chat, mid):
+            return ctx.bot.edit_message_caption(chat_id=chat, message_id=mid, caption=caption, parse_mode=ParseMode.HTML)
+    futs = [scheduler.submit(chat, lambda chat=chat, mid=mid: edit(chat, mid)) for chat, mid in replicas]
+    release_turn()
+    for (chat, mid), result in zip(replicas, await asyncio.gather(*futs, return_exceptions=True)):
+        if isinstance(result, Exception) and "not modified" not in str(result).lower():
+            logger.error("Erro ao editar réplica %s em %s: %s", mid, chat, result)
+
+async def handle_delete_command(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Trata /apagar em resposta a um post: apaga o post e todas as réplicas. True se era o comando."""
+    msg = update.channel_post
+    if not msg or not _is_delete_command(msg):
+        return False
+    target = msg.reply_to_message
+    by_chat: dict[int, list[int]] = {}
+    for chat, mid in await ledger.lookup(msg.chat.id, target.message_id):
+        by_chat.setdefault(chat, []).append(mid)
+    futs = [scheduler.submit(chat, lambda chat=chat, ids=ids: ctx.bot.delete_messages(chat, ids))
+            for chat, ids in by_chat.items()]
+    for chat, result in zip(by_chat, await asyncio.gather(*futs, return_exceptions=True)):
+        if isinstance(result, Exception):
+            logger.error("Erro ao apagar réplicas em %s: %s", chat, result)
+    await ledger.forget(msg.chat.id, target.message_id)
+    try:
+        await ctx.bot.delete_messages(msg.chat.id, [target.message_id, msg.message_id])
+    except Exception as e:
+        logger.error("Erro ao apagar post %s no canal %s: %s", target.message_id, msg.chat.id, e)
+    logger.info("🗑 Post %s apagado em %d canais", target.message_id, len(by_chat))
+    return True
+
+# 2️⃣1️⃣ Lotes do getUpdates (UPDATE_MODE=polling): uma ida ao banco por lote, não por update
+_open_albums: OrderedDict = OrderedDict()  # canal -> (media_group_id, partes vistas), entre lotes
+
+async def prefetch_batch(updates: list[Update]):
+    """
+    Antes de o lote entrar nas faixas: carrega juntos a autenticação dos canais de
+    origem e as réplicas de edições e /apagar, e avisa o buffer de álbuns quando o
+    lote já mostra o fim de um álbum. Destinos vêm do índice de rotas em memória.
+    """
+    posts = [u.channel_post for u in updates if u.channel_post]
+    # só canais ausentes do cache: entradas vencidas ficam para channel_authenticate reconferir o criador
+    unknown = {m.chat.id for m in posts if auth_cache.peek(m.chat.id)[0] is None}
+    keys = [(u.edited_channel_post.chat.id, u.edited_channel_post.message_id)
+            for u in updates if u.edited_channel_post]
+    keys += [(m.chat.id, m.reply_to_message.message_id) for m in posts if _is_delete_command(m)]
+
+    async def _auth():
+        if not unknown:
+            return
+        rows = await run_db(lambda sess: sess.query(Channel.id, Channel.owner_id, Channel.username, Channel.title)
+                            .filter(Channel.id.in_(unknown), Channel.authenticated == True).all())
+        for cid, owner_id, username, title in rows:
+            auth_cache.set(cid, (owner_id, username or "", title or ""))
+    await asyncio.gather(_auth(), ledger.prefetch(keys))
+
+    # um post do mesmo canal depois das partes fecha o álbum (o Telegram entrega em ordem por chat)
+    for m in posts:
+        current = _open_albums.get(m.chat.id)
+        if current and current[0] != m.media_group_id:
+            media_group_buffer.expect((m.chat.id, current[0]), current[1])
+            del _open_albums[m.chat.id]
+        if m.media_group_id:
+            seen = current[1] if current and current[0] == m.media_group_id else 0
+            _open_albums[m.chat.id] = (m.media_group_id, seen + 1)
+            _open_albums.move_to_end(m.chat.id)
+    while len(_open_albums) > 10_000:
+        _open_albums.popitem(last=False)
+
+# 2️⃣2️⃣ Central de callbacks
 async def handle_callback_query(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     data = update.callback_query.data or ""
     logger.info("Callback recebido: %s", data)
@@ -530,26 +841,34 @@ async def handle_callback_query(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         "explorar_grupos": explorar_grupos, "menu_sair_grupo": menu_sair_grupo
     }
     if data in simple:
-        return await simple[data](update, ctx)
-
-    prefix = data.split("_", 1)[0]
-    if prefix == "convite":
-        parts = data.split("_")
-        if len(parts) == 2:
-            return await convite_manual(update, ctx)
-        else:
-            return await handle_convite_response(update, ctx)
+        return await _timed(data, simple[data], update, ctx)
 
     routes = {
         "gerenciar": gerenciar_grupo, "aceitar": handle_convite_response,
         "recusar": handle_convite_response, "vergrp": ver_grupo,
-        "solicit": solicitar_entrada, "aceitar_ext": handle_ext_response,
+        "solicit": solicitar_entrada, "expl": explorar_pagina, "aceitar_ext": handle_ext_response,
         "recusar_ext": handle_ext_response, "remover": remocao_canal,
         "remover_confirm": remover_confirm, "delete": prompt_delete_group,
         "delete_confirm": delete_confirm, "sair_confirm": sair_confirm
     }
+    # rotas com duas palavras (ex: remover_confirm) têm precedência sobre a primeira palavra
+    words = data.split("_")
+    prefix = "_".join(words[:2]) if "_".join(words[:2]) in routes else words[0]
+    if prefix == "convite":
+        if len(words) == 2:
+            return await _timed("convite", convite_manual, update, ctx)
+        else:
+            return await _timed("convite_resposta", handle_convite_response, update, ctx)
+
     if prefix in routes:
-        return await routes[prefix](update, ctx)
+        return await _timed(prefix, routes[prefix], update, ctx)
 
     await update.callback_query.answer("❌ Ação desconhecida.", show_alert=True)
+
+async def _timed(route: str, handler, update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    start = time.perf_counter()
+    try:
+        return await handler(update, ctx)
+    finally:
+        metrics.CALLBACK_SECONDS.labels(route).observe(time.perf_counter() - start)
             
@@ -0,0 +1,168 @@
+import os, time, asyncio, logging
+from telegram.error import Forbidden, BadRequest
+from db import run_db, Group, GroupChannel
+from routing import routing
+
+logger = logging.getLogger(__name__)
+
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "3"))        # falhas seguidas para abrir o circuito
+BREAKER_BACKOFF_BASE = float(os.getenv("BREAKER_BACKOFF_BASE", "30"))
+BREAKER_BACKOFF_MAX = float(os.getenv("BREAKER_BACKOFF_MAX", "3600"))
+
+# erros que dizem respeito ao destino em si, e não à mensagem enviada
+PERMANENT_BAD_REQUESTS = ("chat not found", "not enough rights", "have no rights", "chat_write_forbidden",
+                          "need administrator rights", "bot was kicked", "chat_admin_required")
+# copy_message(s) devolve isto também quando quem sumiu foi o canal de origem
+AMBIGUOUS_BAD_REQUESTS = ("chat not found",)
+
+class DestinationUnavailable(Exception):
+    """
+    Envio não tentado: o destino está em quarentena (retry_in None) ou com o
+    circuito aberto (retry_in = segundos até a próxima sonda poder passar).
+    """
+
+    def __init__(self, chat_id: int, retry_in: float | None = None):
+        super().__init__(chat_id)
+        self.chat_id = chat_id
+        self.retry_in = retry_in
+
+def is_permanent(error: Exception) -> bool:
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and any(p in str(error).lower() for p in PERMANENT_BAD_REQUESTS)
+
+class DestinationHealth:
+    """
+    Circuit breaker por canal de destino.
+    Erro permanente (bot removido, canal apagado): o canal é marcado inativo em
+    group_channels, deixa de ser destino no índice de rotas (segue como origem)
+    e os donos dos grupos são avisados.
+    Erros transitórios seguidos abrem o circuito com backoff exponencial; vencido o
+    prazo, um único envio passa como sonda e, se der certo, o circuito fecha.
+    """
+
+    def __init__(self, notify=None, probe=None):
+        self._notify = notify                 # corrotina notify(user_id, texto)
+        self._probe = probe                   # corrotina probe(chat_id): levanta erro se o destino não existe
+        self._failures: dict[int, int] = {}
+        self._trips: dict[int, int] = {}
+        self._open_until: dict[int, float] = {}
+        self._probing: set[int] = set()
+        self._quarantined: set[int] = set()
+
+    def is_quarantined(self, chat_id: int) -> bool:
+        return chat_id in self._quarantined
+
+    def retry_in(self, chat_id: int) -> float | None:
+        """Segundos até o circuito deixar passar uma sonda; None se o destino está em quarentena."""
+        if chat_id in self._quarantined:
+            return None
+        return max(0.0, self._open_until.get(chat_id, 0) - time.monotonic())
+
+    def open_circuits(self) -> set[int]:
+        """Destinos com o circuito aberto agora (ainda sem direito a sonda)."""
+        now = time.monotonic()
+        return {cid for cid, until in self._open_until.items() if until > now}
+
+    def allow(self, chat_id: int) -> bool:
+        if chat_id in self._quarantined:
+            return False
+        until = self._open_until.get(chat_id)
+        if until is None:
+            return True
+        if time.monotonic() < until or chat_id in self._probing:
+            return False
+        self._probing.add(chat_id)  # meio-aberto: deixa passar uma sonda
+        return True
+
+    def success(self, chat_id: int):
+        if chat_id in self._open_until:
+            logger.info("✅ Destino %s voltou a responder, circuito fechado", chat_id)
+        self._failures.pop(chat_id, None)
+        self._trips.pop(chat_id, None)
+        self._open_until.pop(chat_id, None)
+        self._probing.discard(chat_id)
+
+    async def failure(self, chat_id: int, error: Exception):
+        self._probing.discard(chat_id)
+        if is_permanent(error):
+            if not await self._destination_gone(chat_id, error):
+                return  # a origem é que sumiu: problema da mensagem, não do destino
+            await self.quarantine(chat_id, str(error))
+            return
+        if isinstance(error, BadRequest):
+            return  # problema da mensagem, não do destino
+        failures = self._failures[chat_id] = self._failures.get(chat_id, 0) + 1
+        if failures >= BREAKER_THRESHOLD or chat_id in self._open_until:
+            trips = self._trips[chat_id] = self._trips.get(chat_id, 0) + 1
+            backoff = min(BREAKER_BACKOFF_MAX, BREAKER_BACKOFF_BASE * 2 ** (trips - 1))
+            self._open_until[chat_id] = time.monotonic() + backoff
+            logger.warning("⚡ Circuito aberto para %s por %.0fs: %s", chat_id, backoff, error)
+
+    async def _destination_gone(self, chat_id: int, error: Exception) -> bool:
+        """Para erros ambíguos, só confirma a quarentena se o próprio destino não responder ao probe."""
+        if self._probe is None or not isinstance(error, BadRequest):
+            return True
+        if not any(p in str(error).lower() for p in AMBIGUOUS_BAD_REQUESTS):
+            return True
+        try:
+            await self._probe(chat_id)
+        except Exception as e:
+            return is_permanent(e)
+        logger.warning("⚠️ %s para %s, mas o destino existe: origem indisponível", error, chat_id)
+        return False
+
+    async def quarantine(self, chat_id: int, reason: str):
+        if chat_id in self._quarantined:
+            return
+        self._quarantined.add(chat_id)
+
+        def _deactivate(sess):
+            rows = sess.query(GroupChannel).filter_by(channel_id=chat_id, active=True).all()
+            for gc in rows:
+                gc.active = False
+            groups = sess.query(Group).filter(Group.id.in_([gc.group_id for gc in rows])).all() if rows else []
+            return [(g.id, g.name, g.owner_id) for g in groups]
+        groups = await run_db(_deactivate)
+        routing.pause(chat_id)
+        logger.warning("🚫 Destino %s em quarentena (%d grupos): %s", chat_id, len(groups), reason)
+        if self._notify:
+            for _, name, owner_id in groups:
+                try:
+                    await self._notify(owner_id, f"🚫 O canal {chat_id} foi desativado no grupo {name}: "
+                                                 f"o bot não consegue mais postar lá ({reason}). "
+                                                 f"Os posts do canal continuam sendo replicados.")
+                except Exception as e:
+                    logger.error("Erro ao avisar dono %s sobre quarentena: %s", owner_id, e)
+
+    async def load(self):
+        """
+        Relê do banco quais destinos estão em quarentena (group_channels.active = False).
+        Quarentena e reativação podem acontecer em outro processo (web x worker de entregas).
+        """
+        rows = await run_db(lambda sess: sess.query(GroupChannel.channel_id)
+                            .filter_by(active=False).distinct().all())
+        quarantined = {cid for (cid,) in rows}
+        for cid in self._quarantined - quarantined:
+            self.success(cid)  # reativado em outro processo: começa com o circuito fechado
+        self._quarantined = quarantined
+
+    async def refresh_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error("Erro ao recarregar quarentenas: %s", e)
+
+    async def reactivate(self, chat_id: int):
+        """Bot voltou a ser admin do canal: reativa os vínculos e o canal volta a ser destino."""
+        self._quarantined.discard(chat_id)
+        self.success(chat_id)
+
+        def _activate(sess):
+            rows = sess.query(GroupChannel).filter_by(channel_id=chat_id, active=False).all()
+            for gc in rows:
+                gc.active = True
+        await run_db(_activate)
+        routing.resume(chat_id)
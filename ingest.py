@@ -0,0 +1,182 @@
+import os, time, asyncio, logging
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from telegram import Update
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))  # por faixa
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "8"))
+UPDATE_ENQUEUE_TIMEOUT = float(os.getenv("UPDATE_ENQUEUE_TIMEOUT", "5"))  # segundos antes de devolver 503
+UPDATE_DEDUP_SIZE = int(os.getenv("UPDATE_DEDUP_SIZE", "10000"))
+
+# 🚦 Faixas de prioridade, da mais para a menos urgente, cada uma com seu teto de workers
+LANES = ("interactive", "replication", "background")
+LANE_LIMITS = {
+    "interactive": int(os.getenv("LANE_INTERACTIVE_WORKERS", str(UPDATE_WORKERS))),
+    "replication": int(os.getenv("LANE_REPLICATION_WORKERS", str(max(1, UPDATE_WORKERS - 2)))),
+    "background": int(os.getenv("LANE_BACKGROUND_WORKERS", str(max(1, UPDATE_WORKERS // 4)))),
+}
+LANE_MAX_WAIT = float(os.getenv("LANE_MAX_WAIT", "2"))  # segundos na fila antes de furar a prioridade
+
+def lane_for(update: Update) -> str:
+    """Menus e conversas primeiro, replicação depois, o resto (ex: my_chat_member) por último."""
+    if update.callback_query or update.message:
+        return "interactive"
+    if update.channel_post or update.edited_channel_post:
+        return "replication"
+    return "background"
+
+# 🔢 Ordem por canal: cada post/edição espera a vez do anterior do mesmo chat
+_turn: ContextVar = ContextVar("chat_turn", default=None)
+
+def order_key(update: Update) -> int | None:
+    msg = update.channel_post or update.edited_channel_post
+    return msg.chat.id if msg else None
+
+def release_turn():
+    """
+    O handler já fez o que precisava sair em ordem (ex: agendou as cópias no scheduler):
+    o próximo update do mesmo canal pode seguir sem esperar a entrega terminar.
+    Sem chamada explícita, a vez é liberada quando o update termina.
+    """
+    turn = _turn.get()
+    if turn is not None and not turn.done():
+        turn.set_result(None)
+
+class Lane:
+    def __init__(self, name: str, limit: int, maxsize: int):
+        self.name = name
+        self.limit = limit
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.enqueued_at: deque[float] = deque()  # instante de entrada de cada update, na ordem da fila
+        self.running = 0
+
+    async def put(self, update: Update):
+        await self.queue.put(update)
+        self.enqueued_at.append(time.monotonic())  # sem await entre os dois: as filas andam juntas
+
+    def get_nowait(self) -> tuple[Update, float]:
+        return self.queue.get_nowait(), self.enqueued_at.popleft()
+
+    def head_wait(self, now: float) -> float:
+        """Há quanto tempo o primeiro da fila espera (0 se vazia)."""
+        return now - self.enqueued_at[0] if self.enqueued_at else 0.0
+
+    def ready(self) -> bool:
+        return self.queue.qsize() > 0 and self.running < self.limit
+
+class UpdateIngestor:
+    """
+    Recebe updates do webhook, enfileira e responde na hora.
+    Cada update cai numa faixa (interactive, replication, background) com fila e
+    teto de concorrência próprios; um pool de tarefas atende sempre a faixa mais
+    prioritária com trabalho, exceto quando o primeiro de uma faixa menor já
+    esperou LANE_MAX_WAIT (proteção contra inanição). Quando uma fila enche, put()
+    espera (backpressure) e, estourado o prazo, recusa o update.
+    update_ids recentes ficam num LRU para descartar reentregas do Telegram.
+    Posts e edições de um mesmo canal passam em ordem de chegada: cada um espera
+    o anterior do mesmo chat liberar a vez (release_turn) antes de rodar.
+    """
+
+    def __init__(self, app, workers: int = UPDATE_WORKERS, maxsize: int = UPDATE_QUEUE_SIZE,
+                 dedup_size: int = UPDATE_DEDUP_SIZE, limits: dict = LANE_LIMITS):
+        self.app = app
+        self.workers = workers
+        self.lanes = {name: Lane(name, limits[name], maxsize) for name in LANES}
+        self._wakeup = asyncio.Event()
+        self._seen: OrderedDict = OrderedDict()
+        self._dedup_size = dedup_size
+        self._tasks: list[asyncio.Task] = []
+        self._turns: dict[int, asyncio.Future] = {}  # chat -> vez do último update dele
+        for lane in self.lanes.values():
+            metrics.UPDATE_QUEUE.labels(lane.name).set_function(lane.queue.qsize)
+
+    def _is_duplicate(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            self._seen.move_to_end(update_id)
+            return True
+        self._seen[update_id] = None
+        if len(self._seen) > self._dedup_size:
+            self._seen.popitem(last=False)
+        return False
+
+    async def put(self, update: Update, timeout: float = UPDATE_ENQUEUE_TIMEOUT) -> bool:
+        """Enfileira o update; False se a fila continuou cheia até o prazo (o Telegram reenvia)."""
+        if self._is_duplicate(update.update_id):
+            logger.info("♻️ Update %s repetido, ignorado", update.update_id)
+            return True
+        lane = self.lanes[lane_for(update)]
+        try:
+            await asyncio.wait_for(lane.put(update), timeout)
+        except asyncio.TimeoutError:
+            self._seen.pop(update.update_id, None)
+            logger.warning("🚧 Fila %s cheia, update %s recusado", lane.name, update.update_id)
+            return False
+        # aqui passam webhook, polling e repasses: conta uma vez, no worker que vai processar
+        metrics.UPDATES.labels(tracing.update_kind(update)).inc()
+        self._wakeup.set()
+        return True
+
+    def qsize(self) -> int:
+        return sum(lane.queue.qsize() for lane in self.lanes.values())
+
+    def _pick(self) -> Lane | None:
+        now = time.monotonic()
+        ready = [lane for lane in self.lanes.values() if lane.ready()]
+        if not ready:
+            return None
+        starving = [lane for lane in ready if lane.head_wait(now) >= LANE_MAX_WAIT]
+        if starving:
+            return max(starving, key=lambda lane: lane.head_wait(now))
+        return ready[0]  # LANES está em ordem de prioridade
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10):
+        try:
+            await asyncio.wait_for(asyncio.gather(*(lane.queue.join() for lane in self.lanes.values())), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("⏹ Encerrando com %d updates na fila", self.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            lane = self._pick()
+            if lane is None:
+                await self._wakeup.wait()
+                continue
+            update, queued_at = lane.get_nowait()
+            # a vez é tomada aqui, sem await no meio, então segue a ordem da fila
+            key, prev, turn = order_key(update), None, None
+            if key is not None:
+                prev = self._turns.get(key)
+                turn = self._turns[key] = asyncio.get_running_loop().create_future()
+            lane.running += 1
+            start = time.monotonic()
+            metrics.LANE_WAIT_SECONDS.labels(lane.name).observe(start - queued_at)
+            token = _turn.set(turn)
+            try:
+                if prev is not None:
+                    await prev
+                with tracing.trace(tracing.update_kind(update), update_id=update.update_id, lane=lane.name):
+                    await self.app.process_update(update)
+            except Exception as e:
+                logger.error("Erro ao processar update %s: %s", update.update_id, e)
+            finally:
+                _turn.reset(token)
+                if turn is not None:
+                    if not turn.done():
+                        turn.set_result(None)
+                    if self._turns.get(key) is turn:
+                        del self._turns[key]
+                metrics.LANE_SECONDS.labels(lane.name).observe(time.monotonic() - start)
+                lane.running -= 1
+                lane.queue.task_done()
+                self._wakeup.set()  # vaga liberada: outro worker pode pegar desta faixa
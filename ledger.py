@@ -0,0 +1,111 @@
+import os, asyncio, logging
+from datetime import timedelta
+from db import run_db, utcnow, Replica
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", "1"))
+LEDGER_BATCH = int(os.getenv("LEDGER_BATCH", "500"))
+LEDGER_RETENTION_DAYS = float(os.getenv("LEDGER_RETENTION_DAYS", "7"))
+LEDGER_PRUNE_INTERVAL = float(os.getenv("LEDGER_PRUNE_INTERVAL", "3600"))
+
+class ReplicaLedger:
+    """
+    Registra (origem, msg) -> (destino, msg) de cada réplica entregue.
+    As gravações ficam num buffer e vão ao banco em lote, fora do caminho de entrega;
+    consultas por origem usam o índice ix_replicas_source.
+    """
+
+    def __init__(self):
+        self._pending: list[dict] = []
+        self._tasks: list[asyncio.Task] = []
+        self._flushing = None
+        self._prefetched = TTLCache(ttl=60)  # (origem, msg) -> [(destino, msg)] já lidas do banco
+
+    def record(self, src_chat_id: int, src_msg_id: int, dst_chat_id: int, dst_msg_id: int):
+        self._pending.append({
+            "src_chat_id": src_chat_id, "src_msg_id": src_msg_id,
+            "dst_chat_id": dst_chat_id, "dst_msg_id": dst_msg_id, "created_at": utcnow()
+        })
+        if len(self._pending) >= LEDGER_BATCH and not self._flushing:
+            self._flushing = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        rows, self._pending = self._pending, []
+        try:
+            if rows:
+                await run_db(lambda sess: sess.execute(Replica.__table__.insert(), rows))
+            for r in rows:  # saíram do buffer: quem já foi pré-carregado precisa vê-las
+                stored = self._prefetched.get((r["src_chat_id"], r["src_msg_id"]))
+                if stored is not None:
+                    stored.append((r["dst_chat_id"], r["dst_msg_id"]))
+        except Exception as e:
+            logger.error("Erro ao gravar %d réplicas no ledger: %s", len(rows), e)
+            self._pending[:0] = rows
+        finally:
+            self._flushing = None
+
+    async def lookup(self, src_chat_id: int, src_msg_id: int) -> list[tuple[int, int]]:
+        pending = [(r["dst_chat_id"], r["dst_msg_id"]) for r in self._pending
+                   if r["src_chat_id"] == src_chat_id and r["src_msg_id"] == src_msg_id]
+        stored = self._prefetched.pop((src_chat_id, src_msg_id))
+        if stored is None:
+            stored = await run_db(lambda sess: sess.query(Replica.dst_chat_id, Replica.dst_msg_id)
+                                  .filter_by(src_chat_id=src_chat_id, src_msg_id=src_msg_id).all())
+        return list(dict.fromkeys([tuple(r) for r in stored] + pending))  # o flush pode cruzar com o prefetch
+
+    async def prefetch(self, keys):
+        """Carrega numa só consulta as réplicas de vários (origem, msg); lookup() as usa sem ir ao banco."""
+        keys = set(keys)
+        if not keys:
+            return
+        chats, ids = {k[0] for k in keys}, {k[1] for k in keys}
+        rows = await run_db(lambda sess: sess.query(Replica.src_chat_id, Replica.src_msg_id,
+                                                    Replica.dst_chat_id, Replica.dst_msg_id)
+                            .filter(Replica.src_chat_id.in_(chats), Replica.src_msg_id.in_(ids)).all())
+        found = {key: [] for key in keys}
+        for src_chat, src_msg, dst_chat, dst_msg in rows:
+            if (src_chat, src_msg) in found:
+                found[(src_chat, src_msg)].append((dst_chat, dst_msg))
+        for key, replicas in found.items():
+            self._prefetched.set(key, replicas)
+
+    async def forget(self, src_chat_id: int, src_msg_id: int):
+        self._prefetched.pop((src_chat_id, src_msg_id))
+        self._pending = [r for r in self._pending
+                         if not (r["src_chat_id"] == src_chat_id and r["src_msg_id"] == src_msg_id)]
+        await run_db(lambda sess: sess.query(Replica)
+                     .filter_by(src_chat_id=src_chat_id, src_msg_id=src_msg_id).delete())
+
+    async def prune(self):
+        cutoff = utcnow() - timedelta(days=LEDGER_RETENTION_DAYS)
+        removed = await run_db(lambda sess: sess.query(Replica).filter(Replica.created_at < cutoff).delete())
+        if removed:
+            logger.info("🧹 %d réplicas antigas removidas do ledger", removed)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(LEDGER_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def _prune_loop(self):
+        while True:
+            try:
+                await self.prune()
+            except Exception as e:
+                logger.error("Erro ao podar o ledger: %s", e)
+            await asyncio.sleep(LEDGER_PRUNE_INTERVAL)
+
+    def start(self, prune: bool = True):
+        """prune: só um papel limpa o ledger (o worker de entregas, ou o web em DELIVERY_MODE=inline)."""
+        self._tasks = [asyncio.create_task(self._flush_loop())]
+        if prune:
+            self._tasks.append(asyncio.create_task(self._prune_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await self.flush()
+
+ledger = ReplicaLedger()
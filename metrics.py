@@ -0,0 +1,57 @@
+import time
+import tracing
+from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+from telegram.request import HTTPXRequest
+
+# 📈 Métricas Prometheus expostas em /metrics (bot.py)
+UPDATES = Counter("bot_updates_total", "Updates recebidos, por tipo", ["type"])
+CALLBACK_SECONDS = Histogram("bot_callback_seconds", "Latência dos handlers de callback, por rota", ["route"])
+FANOUT_SIZE = Histogram("bot_fanout_destinations", "Destinos por post replicado",
+                        buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+REPLICATION_SECONDS = Histogram("bot_replication_seconds", "Do post na origem até a entrega em todos os destinos",
+                                buckets=(0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300))
+API_CALLS = Counter("bot_api_calls_total", "Chamadas ao Bot API, por método e resultado", ["method", "outcome"])
+API_SECONDS = Histogram("bot_api_seconds", "Latência das chamadas ao Bot API, por método", ["method"])
+DB_QUERIES = Counter("bot_db_queries_total", "Comandos SQL executados, por tipo", ["kind"])
+DB_SECONDS = Histogram("bot_db_query_seconds", "Duração dos comandos SQL, por tipo", ["kind"],
+                       buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5))
+DB_POOL_WAIT = Histogram("bot_db_pool_wait_seconds", "Espera por conexão do pool do SQLAlchemy",
+                         buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+ALBUMS_OPEN = Gauge("bot_albums_open", "Álbuns sendo juntados no buffer")
+ALBUM_PARTS = Histogram("bot_album_parts", "Partes por álbum entregue", buckets=(1, 2, 3, 4, 5, 6, 7, 8, 9, 10))
+UPDATE_QUEUE = Gauge("bot_update_queue_depth", "Updates aguardando processamento, por faixa", ["lane"])
+POLL_BATCH = Histogram("bot_poll_batch_size", "Updates por chamada de getUpdates (UPDATE_MODE=polling)",
+                       buckets=(1, 2, 5, 10, 25, 50, 75, 100))
+LANE_WAIT_SECONDS = Histogram("bot_lane_wait_seconds", "Tempo na fila até um worker pegar o update, por faixa",
+                              ["lane"], buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+LANE_SECONDS = Histogram("bot_lane_processing_seconds", "Tempo processando o update, por faixa", ["lane"],
+                         buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+HTTP_POOL_WAIT = Histogram("bot_http_pool_wait_seconds", "Espera por conexão livre no pool HTTP do Bot API",
+                           buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+HTTP_CONNECTIONS = Counter("bot_http_requests_total",
+                           "Requisições ao Bot API por conexão: reused (keep-alive), new ou pool_timeout",
+                           ["connection"])
+
+OUTCOMES = {200: "ok", 400: "bad_request", 403: "forbidden", 429: "retry_after"}
+
+def render() -> tuple[bytes, str]:
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest que conta e cronometra cada chamada ao Bot API."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        with tracing.span("api", method=api_method) as span:
+            try:
+                status, payload = await super().do_request(url, method, request_data, **kwargs)
+            except Exception:
+                API_CALLS.labels(api_method, "network_error").inc()
+                raise
+            finally:
+                API_SECONDS.labels(api_method).observe(time.perf_counter() - start)
+            if span:
+                span.attrs["status"] = status
+        API_CALLS.labels(api_method, OUTCOMES.get(status, "error")).inc()
+        return status, payload
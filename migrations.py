@@ -0,0 +1,107 @@
+import logging
+from sqlalchemy import text, inspect
+from sqlalchemy.exc import DBAPIError
+from db import engine, utcnow, IS_SQLITE, Base
+
+logger = logging.getLogger(__name__)
+
+def add_column(table: str, column: str, ddl: str):
+    """Passo que adiciona uma coluna só se ela ainda não existir (SQLite não tem ADD COLUMN IF NOT EXISTS)."""
+    def step(conn):
+        if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return step
+
+# 🗂 Migrações versionadas: (versão, descrição, passos)
+# Cada passo é um comando SQL ou uma função step(conn). Aplicadas em ordem, uma
+# transação por versão; a versão atual fica em schema_version.
+# Use sempre passos idempotentes (IF NOT EXISTS): bancos novos já nascem com o
+# esquema atual via create_all (init_schema).
+MIGRATIONS = [
+    (1, "índices de consulta e unicidade (group_id, channel_id)", [
+        # mantém um vínculo por (grupo, canal), preferindo o aceito e o mais antigo
+        """
+        DELETE FROM group_channels WHERE EXISTS (
+            SELECT 1 FROM group_channels o
+            WHERE o.group_id = group_channels.group_id
+              AND o.channel_id = group_channels.channel_id
+              AND o.id <> group_channels.id
+              AND (CASE WHEN o.accepted THEN 1 ELSE 0 END > CASE WHEN group_channels.accepted THEN 1 ELSE 0 END
+                   OR (CASE WHEN o.accepted THEN 1 ELSE 0 END = CASE WHEN group_channels.accepted THEN 1 ELSE 0 END
+                       AND o.id < group_channels.id))
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_group_channels_group_channel ON group_channels (group_id, channel_id)",
+        "CREATE INDEX IF NOT EXISTS ix_group_channels_channel_accepted ON group_channels (channel_id) WHERE accepted",
+        "CREATE INDEX IF NOT EXISTS ix_channels_username ON channels (username)",
+        "CREATE INDEX IF NOT EXISTS ix_channels_owner_id ON channels (owner_id)",
+        "CREATE INDEX IF NOT EXISTS ix_groups_owner_id ON groups (owner_id)",
+    ]),
+    (2, "group_channels.active (quarentena de destinos)", [
+        add_column("group_channels", "active", "BOOLEAN NOT NULL DEFAULT TRUE"),
+    ]),
+    (3, "groups.member_count (explorar por tamanho sem agregar)", [
+        add_column("groups", "member_count", "INTEGER NOT NULL DEFAULT 0"),
+        """
+        UPDATE groups SET member_count = (
+            SELECT COUNT(*) FROM group_channels gc WHERE gc.group_id = groups.id AND gc.accepted
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS ix_groups_member_count_id ON groups (member_count, id)",
+    ]),
+    (4, "índice em lower(channels.username) (convite em lote)", [
+        "CREATE INDEX IF NOT EXISTS ix_channels_username_lower ON channels (lower(username))",
+    ]),
+]
+
+def current_version(conn) -> int:
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar()
+
+def upgrade(target: int | None = None):
+    """Aplica as migrações pendentes até `target` (ou até a última)."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, description TEXT, applied_at TIMESTAMP)"
+        ))
+    for version, description, steps in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with engine.begin() as conn:
+            if not IS_SQLITE:
+                # vários processos podem subir juntos: só um migra por vez
+                conn.execute(text("SELECT pg_advisory_xact_lock(7261001)"))
+            if version <= current_version(conn):
+                continue
+            logger.info("🗂 Migração %d: %s", version, description)
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(text(step))
+            conn.execute(
+                text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {"v": version, "d": description, "t": utcnow()}
+            )
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def init_schema():
+    """
+    Deixa o banco pronto para uso: cria tabelas que faltam e aplica migrações.
+    Idempotente; no caso comum (banco já na última versão) custa uma consulta.
+    """
+    try:
+        with engine.connect() as conn:
+            if current_version(conn) >= LATEST_VERSION:
+                return
+    except DBAPIError:
+        pass  # schema_version ainda não existe
+    Base.metadata.create_all(engine)
+    upgrade()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    init_schema()
+    with engine.connect() as conn:
+        logger.info("✅ Esquema na versão %d", current_version(conn))
@@ -0,0 +1,175 @@
+import os, hmac, json, socket, asyncio, hashlib, ipaddress, logging
+from bisect import bisect
+from datetime import timedelta
+from db import run_db, utcnow, WorkerNode
+
+logger = logging.getLogger(__name__)
+
+# 🧩 Modo particionado: cada worker é dono de uma fatia (hash consistente) dos canais de origem.
+# Updates de um canal recebidos pelo worker errado são repassados ao dono por um socket TCP local,
+# assim álbuns e a ordem por chat continuam num único processo.
+PARTITION_MODE = os.getenv("PARTITION_MODE", "off") == "on"
+# Com vários workers web, o mesmo canal interno avisa mudanças de rotas a todos, mesmo sem particionar:
+# o índice de rotas e o cache de menus são por processo. auto liga só com WEB_CONCURRENCY > 1.
+_peer_sync = os.getenv("PEER_SYNC", "auto")
+PEER_SYNC = PARTITION_MODE or _peer_sync == "on" or (
+    _peer_sync == "auto" and int(os.getenv("WEB_CONCURRENCY", "1")) > 1)
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+PARTITION_BIND = os.getenv("PARTITION_BIND", "127.0.0.1")
+PARTITION_ADVERTISE = os.getenv("PARTITION_ADVERTISE", PARTITION_BIND)
+PARTITION_PORT = int(os.getenv("PARTITION_PORT", "0"))   # 0 = porta livre qualquer
+PARTITION_SECRET = os.getenv("PARTITION_SECRET", "")    # obrigatório se PARTITION_BIND não for loopback
+PARTITION_VNODES = int(os.getenv("PARTITION_VNODES", "100"))
+HEARTBEAT_INTERVAL = float(os.getenv("PARTITION_HEARTBEAT", "5"))
+WORKER_TIMEOUT = float(os.getenv("PARTITION_WORKER_TIMEOUT", "20"))
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+def _is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+class HashRing:
+    def __init__(self, nodes=(), vnodes: int = PARTITION_VNODES):
+        self.nodes = frozenset(nodes)
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [n for _, n in points]
+
+    def owner(self, key) -> str | None:
+        if not self._hashes:
+            return None
+        return self._owners[bisect(self._hashes, _hash(str(key))) % len(self._hashes)]
+
+def partition_key(update) -> int | None:
+    """Chave de partição: o canal de origem (posts e mudanças de status do bot em canais)."""
+    msg = update.channel_post or update.edited_channel_post
+    if msg:
+        return msg.chat.id
+    if update.my_chat_member and update.my_chat_member.chat.type == "channel":
+        return update.my_chat_member.chat.id
+    return None
+
+class Partitioner:
+    """
+    Mantém o anel de workers vivos (tabela workers + heartbeat), repassa updates ao dono
+    (só com PARTITION_MODE) e recebe os repassados pelos outros; com PEER_SYNC, avisa
+    os outros workers a cada mudança de rotas. Mensagens no canal interno são linhas JSON:
+    {"type": "update", "update": {...}} ou {"type": "routing"} (índice de rotas mudou).
+    """
+
+    def __init__(self, on_update, on_routing_change, worker_id: str = WORKER_ID):
+        self.id = worker_id
+        self.enabled = PARTITION_MODE  # repasse de updates ao dono do canal
+        self.synced = PEER_SYNC        # registro de workers e avisos de mudança de rotas
+        self.ring = HashRing([worker_id])
+        self.address = None
+        self._on_update = on_update
+        self._on_routing_change = on_routing_change
+        self._peers: dict[str, str] = {}          # worker -> host:porta
+        self._conns: dict[str, tuple] = {}        # worker -> (reader, writer)
+        self._server = None
+        self._task = None
+
+    def is_local(self, key) -> bool:
+        return self.ring.owner(key) in (None, self.id)
+
+    async def start(self):
+        if not self.synced:
+            return
+        if not PARTITION_SECRET and not _is_loopback(PARTITION_BIND):
+            # qualquer um que alcance a porta poderia injetar updates na fila
+            raise RuntimeError(f"PARTITION_BIND={PARTITION_BIND} fora do loopback exige PARTITION_SECRET")
+        self._server = await asyncio.start_server(self._serve, PARTITION_BIND, PARTITION_PORT)
+        port = self._server.sockets[0].getsockname()[1]
+        self.address = f"{PARTITION_ADVERTISE}:{port}"
+        await self._heartbeat()
+        self._task = asyncio.create_task(self._heartbeat_loop())
+        logger.info("🧩 Worker %s no anel em %s", self.id, self.address)
+
+    async def stop(self):
+        if not self.synced:
+            return
+        if self._task:
+            self._task.cancel()
+        await run_db(lambda sess: sess.query(WorkerNode).filter_by(id=self.id).delete())
+        for _, writer in self._conns.values():
+            writer.close()
+        if self._server:
+            self._server.close()
+
+    async def _heartbeat(self):
+        def _beat(sess):
+            now = utcnow()
+            sess.merge(WorkerNode(id=self.id, address=self.address, heartbeat_at=now))
+            live = (sess.query(WorkerNode.id, WorkerNode.address)
+                    .filter(WorkerNode.heartbeat_at > now - timedelta(seconds=WORKER_TIMEOUT)).all())
+            return dict(live)
+        peers = await run_db(_beat)
+        if set(peers) != self.ring.nodes:
+            logger.info("🧩 Rebalanceando: %d workers (%s)", len(peers), ", ".join(sorted(peers)))
+            self.ring = HashRing(peers)
+            if not self.enabled and len(peers) > 1:
+                logger.warning("⚠️ Vários workers sem PARTITION_MODE=on: rotas e menus são sincronizados, "
+                               "mas partes de um álbum e posts de um canal podem cair em processos diferentes")
+        for gone in set(self._conns) - set(peers):
+            self._conns.pop(gone)[1].close()
+        self._peers = peers
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self._heartbeat()
+            except Exception as e:
+                logger.error("Erro no heartbeat do worker %s: %s", self.id, e)
+
+    async def _send(self, worker: str, message: dict) -> bool:
+        line = (json.dumps({**message, "secret": PARTITION_SECRET}) + "\n").encode()
+        for _ in range(2):  # uma reconexão se a conexão cacheada caiu
+            try:
+                conn = self._conns.get(worker)
+                if conn is None or conn[1].is_closing():
+                    host, port = self._peers[worker].rsplit(":", 1)
+                    conn = self._conns[worker] = await asyncio.open_connection(host, int(port))
+                conn[1].write(line)
+                await conn[1].drain()
+                return True
+            except Exception as e:
+                self._conns.pop(worker, None)
+                logger.warning("Falha ao falar com o worker %s: %s", worker, e)
+        return False
+
+    async def handoff(self, key, data: dict) -> bool:
+        """Repassa o update ao dono de `key`; False se ele é local ou inalcançável (processe aqui)."""
+        owner = self.ring.owner(key)
+        if owner in (None, self.id):
+            return False
+        return await self._send(owner, {"type": "update", "update": data})
+
+    async def broadcast_routing_change(self):
+        if self.synced:
+            for worker in list(self._peers):
+                if worker != self.id:
+                    await self._send(worker, {"type": "routing"})
+
+    async def _serve(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                if not hmac.compare_digest(str(message.get("secret", "")).encode(), PARTITION_SECRET.encode()):
+                    logger.warning("🧩 Mensagem interna com segredo inválido descartada")
+                    continue
+                if message["type"] == "update":
+                    await self._on_update(message["update"])
+                elif message["type"] == "routing":
+                    await self._on_routing_change()
+        except Exception as e:
+            logger.error("Erro no canal interno: %s", e)
+        finally:
+            writer.close()
@@ -0,0 +1,82 @@
+from typing import NamedTuple
+from telegram import Message, InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
+from telegram.constants import ParseMode
+
+# 📦 Envios preparados uma vez por post e reaproveitados em todos os destinos.
+# São tuplas imutáveis: o mesmo objeto vai para o buffer de álbuns, para a fila
+# persistente (to_json) e para cada chamada ao Bot API, sem reler o Message.
+
+INPUT_MEDIA = {"photo": InputMediaPhoto, "video": InputMediaVideo,
+               "document": InputMediaDocument, "audio": InputMediaAudio}
+
+class MediaItem(NamedTuple):
+    kind: str                  # photo | video | document | audio
+    file_id: str
+    caption: str | None        # já em HTML
+    parse_mode: str | None
+
+    def input_media(self):
+        return INPUT_MEDIA[self.kind](self.file_id, caption=self.caption, parse_mode=self.parse_mode)
+
+class AlbumPart(NamedTuple):
+    """Uma parte de álbum esperando no buffer: só o necessário para o envio, não o Message inteiro."""
+    message_id: int
+    date: float                # timestamp do post na origem
+    item: MediaItem
+
+class CopyPayload(NamedTuple):
+    """Post simples: copyMessage (ou copyMessages em lote) a partir da origem."""
+    src_chat_id: int
+    message_id: int
+    date: float
+
+    @property
+    def src_ids(self) -> list[int]:
+        return [self.message_id]
+
+    def to_json(self) -> dict:
+        return {"src": self.src_chat_id, "id": self.message_id, "date": self.date}
+
+class AlbumPayload(NamedTuple):
+    """Álbum: um sendMediaGroup com os InputMedia montados uma única vez."""
+    src_chat_id: int
+    src_ids: tuple[int, ...]
+    items: tuple[MediaItem, ...]
+    media: tuple                # InputMedia* prontos, compartilhados entre destinos
+    date: float
+
+    @classmethod
+    def build(cls, src_chat_id: int, parts: list[AlbumPart]) -> "AlbumPayload":
+        parts = sorted(parts, key=lambda p: p.message_id)
+        items = tuple(p.item for p in parts)
+        return cls(src_chat_id, tuple(p.message_id for p in parts), items,
+                   tuple(item.input_media() for item in items), min(p.date for p in parts))
+
+    def to_json(self) -> dict:
+        return {"src": self.src_chat_id, "ids": list(self.src_ids), "media": [list(i) for i in self.items],
+                "date": self.date}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "AlbumPayload":
+        items = tuple(MediaItem(*i) for i in data["media"])
+        return cls(data["src"], tuple(data["ids"]), items, tuple(i.input_media() for i in items),
+                   data.get("date", 0.0))
+
+def copy_payload(msg: Message) -> CopyPayload:
+    return CopyPayload(msg.chat.id, msg.message_id, msg.date.timestamp())
+
+def album_part(msg: Message) -> AlbumPart | None:
+    """Extrai de uma parte de álbum o tipo, o file_id e a legenda renderizada; None se não for mídia de álbum."""
+    if msg.photo:
+        kind, file_id = "photo", msg.photo[-1].file_id
+    elif msg.video:
+        kind, file_id = "video", msg.video.file_id
+    elif msg.document:
+        kind, file_id = "document", msg.document.file_id
+    elif msg.audio:
+        kind, file_id = "audio", msg.audio.file_id
+    else:
+        return None
+    caption = msg.caption_html if msg.caption else None
+    item = MediaItem(kind, file_id, caption, ParseMode.HTML if caption else None)
+    return AlbumPart(msg.message_id, msg.date.timestamp(), item)
@@ -0,0 +1,71 @@
+import os, asyncio, logging
+from telegram.error import RetryAfter, Conflict
+import metrics
+
+logger = logging.getLogger(__name__)
+
+POLL_LIMIT = int(os.getenv("POLL_LIMIT", "100"))      # máximo do getUpdates
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", "30"))   # segundos de long polling por chamada
+POLL_RETRY = float(os.getenv("POLL_RETRY", "3"))
+
+class UpdatePoller:
+    """
+    Modo long polling: busca até POLL_LIMIT updates por getUpdates e trata o lote
+    como unidade. prefetch(updates) carrega de uma vez o que os handlers vão
+    consultar; depois os updates entram nas faixas do ingestor, em ordem. Com as
+    filas cheias o poller espera, e o Telegram segura o resto (backpressure).
+    """
+
+    def __init__(self, bot, ingestor, prefetch=None, allowed_updates=None,
+                 limit: int = POLL_LIMIT, timeout: int = POLL_TIMEOUT):
+        self.bot = bot
+        self.ingestor = ingestor
+        self.prefetch = prefetch
+        self.allowed_updates = allowed_updates
+        self.limit = limit
+        self.timeout = timeout
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        await self.bot.delete_webhook()  # getUpdates não funciona com webhook registrado
+        self._task = asyncio.create_task(self._loop())
+        logger.info("📡 Long polling iniciado (lotes de até %d)", self.limit)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _loop(self):
+        offset = None
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=offset, limit=self.limit, timeout=self.timeout,
+                                                     allowed_updates=self.allowed_updates)
+            except RetryAfter as e:
+                await asyncio.sleep(float(getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()))
+                continue
+            except Conflict as e:
+                logger.error("Outro processo está lendo getUpdates: %s", e)
+                await asyncio.sleep(POLL_RETRY)
+                continue
+            except Exception as e:
+                logger.error("Erro no getUpdates: %s", e)
+                await asyncio.sleep(POLL_RETRY)
+                continue
+            if not updates:
+                continue
+            # o próximo getUpdates com este offset confirma o lote no Telegram
+            offset = max(u.update_id for u in updates) + 1
+            metrics.POLL_BATCH.observe(len(updates))
+            await self.handle_batch(updates)
+
+    async def handle_batch(self, updates):
+        if self.prefetch:
+            try:
+                await self.prefetch(updates)
+            except Exception as e:
+                logger.error("Erro no prefetch do lote: %s", e)
+        for update in updates:
+            while not await self.ingestor.put(update):
+                pass  # fila cheia: put já esperou e avisou; tenta de novo sem perder o update
@@ -1,71 +1,434 @@
-import os
-from telegram import Bot, Message
-from telegram.constants import ParseMode
+import os, time, json, random, asyncio, logging
+from collections import deque
+from functools import partial
+from datetime import timedelta
+from sqlalchemy import or_, and_
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from db import run_db, utcnow, DeliveryJob
+from ledger import ledger
+import migrations
+from bot_client import bot as BOT
+import tracing
+import metrics
+from ingest import release_turn
+from health import DestinationHealth, DestinationUnavailable
+from payloads import CopyPayload, AlbumPayload
 
-BOT = Bot(token=os.getenv("TELEGRAM_TOKEN"))
+logger = logging.getLogger(__name__)
 
-async def forward(src_chat_id: int, dst_chat_id: int, message: Message):
+health = DestinationHealth(notify=lambda user_id, text: BOT.send_message(user_id, text),
+                           probe=lambda chat_id: BOT.get_chat(chat_id))
+
+COPY_BATCH_MAX = int(os.getenv("COPY_BATCH_MAX", "100"))  # limite do copyMessages; 1 desliga o modo em lote
+
+async def forward(src_chat_id: int, dst_chat_id: int, message_id: int):
     """
-    Encaminha corretamente qualquer tipo de mensagem para outro canal, preservando o conteúdo.
+    Copia qualquer tipo de mensagem para outro canal, preservando conteúdo e formatação.
     Se for um álbum (media_group_id), a lógica de agrupamento deve ocorrer fora desta função.
     """
-    if message.text:
-        await BOT.send_message(dst_chat_id, message.text, parse_mode=ParseMode.HTML)
-
-    elif message.photo:
-        await BOT.send_photo(
-            dst_chat_id,
-            photo=message.photo[-1].file_id,  # maior resolução
-            caption=message.caption_html if message.caption else None,
-            parse_mode=ParseMode.HTML
-        )
-
-    elif message.video:
-        await BOT.send_video(
-            dst_chat_id,
-            video=message.video.file_id,
-            caption=message.caption_html if message.caption else None,
-            parse_mode=ParseMode.HTML
-        )
-
-    elif message.audio:
-        await BOT.send_audio(
-            dst_chat_id,
-            audio=message.audio.file_id,
-            caption=message.caption_html if message.caption else None,
-            parse_mode=ParseMode.HTML
-        )
-
-    elif message.document:
-        await BOT.send_document(
-            dst_chat_id,
-            document=message.document.file_id,
-            caption=message.caption_html if message.caption else None,
-            parse_mode=ParseMode.HTML
-        )
-
-    elif message.voice:
-        await BOT.send_voice(
-            dst_chat_id,
-            voice=message.voice.file_id,
-            caption=message.caption_html if message.caption else None,
-            parse_mode=ParseMode.HTML
-        )
-
-    elif message.animation:
-        await BOT.send_animation(
-            dst_chat_id,
-            animation=message.animation.file_id,
-            caption=message.caption_html if message.caption else None,
-            parse_mode=ParseMode.HTML
-        )
-
-    elif message.video_note:
-        await BOT.send_video_note(
-            dst_chat_id,
-            video_note=message.video_note.file_id
-        )
-
-    else:
-        # fallback para encaminhamento bruto (ex: polls, stickers, etc)
-        await BOT.forward_message(dst_chat_id, src_chat_id, message.message_id)
+    return await BOT.copy_message(dst_chat_id, src_chat_id, message_id)
+
+async def copy_batch(dst_chat_id: int, src_chat_id: int, message_ids: list[int]):
+    """Copia várias mensagens do mesmo canal de origem com uma única chamada copyMessages."""
+    return await BOT.copy_messages(dst_chat_id, src_chat_id, message_ids)
+
+async def forward_album(dst_chat_id: int, album: AlbumPayload):
+    """Envia um álbum inteiro com uma única chamada send_media_group (InputMedia já montados)."""
+    if album.media:
+        return await BOT.send_media_group(dst_chat_id, album.media)
+
+# ⏱ Limites de envio do Bot API (globais e por chat)
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "16"))
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))      # mensagens/s no total
+SEND_PER_CHAT_RATE = float(os.getenv("SEND_PER_CHAT_RATE", "1"))   # mensagens/s por chat
+SEND_PER_CHAT_BURST = int(os.getenv("SEND_PER_CHAT_BURST", "3"))
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class DeliveryScheduler:
+    """
+    Envia para muitos destinos em paralelo respeitando os limites do Telegram.
+    Cada destino tem sua fila (ordem preservada por chat) e seu token bucket;
+    um RetryAfter pausa apenas o chat afetado. Cópias consecutivas da mesma origem
+    que se acumulam na fila de um destino saem juntas num só copyMessages.
+    """
+
+    def __init__(self, concurrency=SEND_CONCURRENCY, global_rate=SEND_GLOBAL_RATE,
+                 per_chat_rate=SEND_PER_CHAT_RATE, per_chat_burst=SEND_PER_CHAT_BURST, health=health):
+        self.health = health
+        self._sem = asyncio.Semaphore(concurrency)
+        self._global = TokenBucket(global_rate, global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        self._buckets: dict[int, TokenBucket] = {}
+        self._lanes: dict[int, deque] = {}
+        self._paused_until: dict[int, float] = {}
+
+    def submit(self, chat_id: int, send, copy: tuple | None = None) -> asyncio.Future:
+        """
+        Agenda send() (fábrica de corrotina) para chat_id; o future resolve com o resultado.
+        copy=(origem, message_id) marca o envio como cópia, candidata ao modo em lote.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = deque()
+            asyncio.create_task(self._drain(chat_id, lane))
+        lane.append((send, fut, copy, tracing.current()))  # o envio entra no trace de quem agendou
+        return fut
+
+    def submit_copy(self, chat_id: int, src_chat_id: int, message_id: int) -> asyncio.Future:
+        return self.submit(chat_id, lambda: forward(src_chat_id, chat_id, message_id),
+                           copy=(src_chat_id, message_id))
+
+    async def fanout(self, chat_ids, make_send) -> dict:
+        """Envia make_send(chat_id) para todos os destinos; devolve {chat_id: resultado ou exceção}."""
+        futs = {cid: self.submit(cid, lambda cid=cid: make_send(cid)) for cid in chat_ids}
+        results = await asyncio.gather(*futs.values(), return_exceptions=True)
+        return dict(zip(futs, results))
+
+    def _take_copy_batch(self, lane: deque) -> list:
+        """Cópias consecutivas no início da fila, mesma origem e ids crescentes (até COPY_BATCH_MAX)."""
+        src, last_id = lane[0][2]
+        batch = [lane[0]]
+        for item in list(lane)[1:COPY_BATCH_MAX]:
+            if not item[2] or item[2][0] != src or item[2][1] <= last_id:
+                break
+            batch.append(item)
+            last_id = item[2][1]
+        return batch
+
+    async def _drain(self, chat_id: int, lane: deque):
+        try:
+            while lane:
+                send, fut, copy, span = lane[0]
+                batch = self._take_copy_batch(lane) if copy and COPY_BATCH_MAX > 1 else [lane[0]]
+                if len(batch) > 1:
+                    ids = [item[2][1] for item in batch]
+                    send = lambda ids=ids: copy_batch(chat_id, copy[0], ids)
+                try:
+                    with tracing.activate(span), tracing.span("send", chat=chat_id, batch=len(batch)):
+                        result = await self._send(chat_id, send)
+                except Exception as e:
+                    for item in batch:
+                        if not item[1].done():
+                            item[1].set_exception(e)
+                else:
+                    # copyMessages devolve um MessageId por mensagem copiada, na mesma ordem
+                    results = result if len(batch) > 1 else [result]
+                    if len(results) != len(batch):
+                        results = [None] * len(batch)
+                    for item, res in zip(batch, results):
+                        if not item[1].done():
+                            item[1].set_result(res)
+                for _ in batch:
+                    lane.popleft()
+        finally:
+            self._lanes.pop(chat_id, None)
+            self._paused_until.pop(chat_id, None)
+            bucket = self._buckets.get(chat_id)
+            if bucket and bucket.full():
+                del self._buckets[chat_id]
+
+    def paused(self) -> set[int]:
+        """Chats em pausa por RetryAfter neste momento."""
+        now = time.monotonic()
+        return {cid for cid, until in self._paused_until.items() if until > now}
+
+    async def _send(self, chat_id: int, send):
+        if self.health and not self.health.allow(chat_id):
+            raise DestinationUnavailable(chat_id, self.health.retry_in(chat_id))
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self._per_chat_rate, self._per_chat_burst)
+        while True:
+            pause = self._paused_until.get(chat_id, 0) - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await bucket.acquire()
+            await self._global.acquire()
+            error = None
+            async with self._sem:
+                try:
+                    result = await send()
+                except RetryAfter as e:
+                    retry = float(getattr(e.retry_after, "total_seconds", lambda: e.retry_after)())
+                    self._paused_until[chat_id] = time.monotonic() + retry
+                    logger.warning("⏸ RetryAfter %.1fs para o chat %s", retry, chat_id)
+                    continue
+                except Exception as e:
+                    error = e
+            if error is not None:
+                # fora do semáforo: a quarentena grava no banco e avisa os donos
+                if self.health:
+                    await self.health.failure(chat_id, error)
+                raise error
+            if self.health:
+                self.health.success(chat_id)
+            return result
+
+scheduler = DeliveryScheduler()
+
+# 📦 Fila persistente de entregas
+# inline: envia direto do processo web; queue: grava em delivery_jobs e um worker separado envia
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "inline")
+JOB_BATCH = int(os.getenv("JOB_BATCH", "50"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "8"))
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "5"))     # segundos
+JOB_BACKOFF_MAX = float(os.getenv("JOB_BACKOFF_MAX", "3600"))
+JOB_LEASE = float(os.getenv("JOB_LEASE", "300"))                 # job "running" abandonado volta para a fila
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_MAX_IN_FLIGHT = int(os.getenv("JOB_MAX_IN_FLIGHT", str(JOB_BATCH * 10)))  # no scheduler, sem resposta ainda
+JOB_MAX_PER_DEST = int(os.getenv("JOB_MAX_PER_DEST", str(COPY_BATCH_MAX)))  # por destino, para um lento não ocupar tudo
+HEALTH_REFRESH_INTERVAL = float(os.getenv("HEALTH_REFRESH_INTERVAL", "30"))  # relê quarentenas do banco
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "0"))  # 0 = sem endpoint de métricas no worker
+
+def _record(src_chat_id: int, src_ids: list[int], dest: int, result):
+    """Anota no ledger as mensagens criadas no destino (MessageId, Message ou tupla delas)."""
+    if result is None or isinstance(result, Exception):
+        return
+    sent = result if isinstance(result, (tuple, list)) else [result]
+    for src_id, out in zip(src_ids, sent):
+        if out is not None:
+            ledger.record(src_chat_id, src_id, dest, out.message_id)
+
+async def deliver(post: CopyPayload, destinos) -> dict:
+    """Replica o post para os destinos: na hora (inline) ou via fila persistente (queue)."""
+    if DELIVERY_MODE == "queue":
+        await enqueue(post.src_chat_id, json.dumps(post.to_json()), destinos)
+        release_turn()
+        return {}
+    futs = {destino: scheduler.submit_copy(destino, post.src_chat_id, post.message_id) for destino in destinos}
+    release_turn()  # já está na fila de cada destino: o próximo post do canal pode ser agendado
+    results = dict(zip(futs, await asyncio.gather(*futs.values(), return_exceptions=True)))
+    for destino, result in results.items():
+        _record(post.src_chat_id, post.src_ids, destino, result)
+    return results
+
+async def deliver_album(album: AlbumPayload, destinos) -> dict:
+    if DELIVERY_MODE == "queue":
+        await enqueue(album.src_chat_id, json.dumps({"album": album.to_json()}), destinos)
+        return {}
+    results = await scheduler.fanout(destinos, lambda destino: forward_album(destino, album))
+    for destino, result in results.items():
+        _record(album.src_chat_id, album.src_ids, destino, result)
+    return results
+
+async def enqueue(src_chat_id: int, payload: str, destinos):
+    now = utcnow()
+    jobs = [
+        {"dest_chat_id": d, "src_chat_id": src_chat_id, "payload": payload,
+         "status": "pending", "attempts": 0, "next_attempt_at": now, "created_at": now}
+        for d in destinos
+    ]
+    if jobs:
+        await run_db(lambda sess: sess.execute(DeliveryJob.__table__.insert(), jobs))
+
+def _claim(sess, limit: int, skip_dests=()):
+    now = utcnow()
+    query = sess.query(DeliveryJob).filter(or_(
+        and_(DeliveryJob.status == "pending", DeliveryJob.next_attempt_at <= now),
+        and_(DeliveryJob.status == "running", DeliveryJob.locked_at < now - timedelta(seconds=JOB_LEASE)),
+    ))
+    if skip_dests:
+        query = query.filter(DeliveryJob.dest_chat_id.notin_(skip_dests))
+    jobs = (
+        query
+        .order_by(DeliveryJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for job in jobs:
+        job.status = "running"
+        job.locked_at = now
+        job.attempts += 1
+    return [(j.id, j.dest_chat_id, j.payload, j.attempts) for j in jobs]
+
+def _renew(sess, job_ids: list[int]):
+    """Renova o lease dos jobs ainda em voo neste worker."""
+    (sess.query(DeliveryJob)
+     .filter(DeliveryJob.id.in_(job_ids), DeliveryJob.status == "running")
+     .update({DeliveryJob.locked_at: utcnow()}, synchronize_session=False))
+
+def _settle(sess, done: list[int], failed: list[tuple]):
+    if done:
+        sess.query(DeliveryJob).filter(DeliveryJob.id.in_(done)).delete(synchronize_session=False)
+    now = utcnow()
+    for job_id, attempts, error, permanent, retry_in in failed:
+        job = sess.get(DeliveryJob, job_id)
+        if not job:
+            continue
+        job.last_error = error[:1000]
+        job.locked_at = None
+        if retry_in is not None:
+            # envio nem tentado (circuito aberto): volta para depois da sonda sem gastar tentativa
+            job.status = "pending"
+            job.attempts -= 1
+            job.next_attempt_at = now + timedelta(seconds=max(retry_in, JOB_POLL_INTERVAL))
+        elif permanent or attempts >= JOB_MAX_ATTEMPTS:
+            job.status = "dead"
+        else:
+            delay = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * 2 ** (attempts - 1))
+            job.status = "pending"
+            job.next_attempt_at = now + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+def _submit_job(dest: int, payload: str) -> tuple[asyncio.Future, int, list[int], float]:
+    """Agenda o job no scheduler; devolve (future, origem, ids de origem, data do post)."""
+    data = json.loads(payload)
+    if "album" in data:
+        album = AlbumPayload.from_json(data["album"])
+        fut = scheduler.submit(dest, lambda: forward_album(dest, album))
+        return fut, album.src_chat_id, list(album.src_ids), album.date
+    src, msg_id = data["src"], data["id"]
+    return scheduler.submit_copy(dest, src, msg_id), src, [msg_id], data.get("date", 0.0)
+
+class JobRunner:
+    """
+    Reivindica jobs enquanto houver vaga (JOB_MAX_IN_FLIGHT), entrega pelo scheduler e
+    liquida cada job assim que o envio dele termina, sem esperar o lote inteiro: um
+    destino pausado não segura os outros. Destinos em RetryAfter, com o circuito aberto
+    ou já com JOB_MAX_PER_DEST jobs em voo ficam fora do claim, e os jobs em voo têm o
+    lease renovado para nenhum outro worker reivindicá-los de novo.
+    """
+
+    def __init__(self, batch: int = JOB_BATCH, max_in_flight: int = JOB_MAX_IN_FLIGHT,
+                 max_per_dest: int = JOB_MAX_PER_DEST):
+        self.batch = batch
+        self.max_in_flight = max_in_flight
+        self.max_per_dest = max_per_dest
+        self._in_flight: dict[int, int] = {}      # job -> destino
+        self._per_dest: dict[int, int] = {}       # destino -> jobs em voo
+        self._done: list[int] = []
+        self._failed: list[tuple] = []
+        self._unsure: list[tuple] = []            # bateram em quarentena: confere no banco antes
+        self._finished_event = asyncio.Event()
+
+    def _skip(self) -> set[int]:
+        skip = scheduler.paused() | health.open_circuits()
+        skip.update(dest for dest, n in self._per_dest.items() if n >= self.max_per_dest)
+        return skip
+
+    async def claim(self) -> int:
+        room = min(self.batch, self.max_in_flight - len(self._in_flight))
+        if room <= 0:
+            return 0
+        claimed = await run_db(_claim, room, self._skip())
+        for job_id, dest, payload, attempts in claimed:
+            try:
+                fut, src, src_ids, date = _submit_job(dest, payload)
+            except Exception as e:
+                logger.error("Job %s com payload inválido: %s", job_id, e)
+                self._failed.append((job_id, attempts, f"payload inválido: {e}", True, None))
+                continue
+            self._in_flight[job_id] = dest
+            self._per_dest[dest] = self._per_dest.get(dest, 0) + 1
+            fut.add_done_callback(partial(self._finished, job_id, dest, attempts, src, src_ids, date))
+        return len(claimed)
+
+    def _finished(self, job_id, dest, attempts, src, src_ids, date, fut: asyncio.Future):
+        del self._in_flight[job_id]
+        self._per_dest[dest] -= 1
+        if not self._per_dest[dest]:
+            del self._per_dest[dest]
+        error = fut.exception()
+        if error is None:
+            _record(src, src_ids, dest, fut.result())
+            self._done.append(job_id)
+            if date:  # jobs gravados antes de o payload levar a data não entram na métrica
+                metrics.REPLICATION_SECONDS.observe(time.time() - date)
+        elif isinstance(error, DestinationUnavailable):
+            if error.retry_in is None:
+                self._unsure.append((job_id, attempts, dest))
+            else:
+                self._failed.append((job_id, attempts, "circuito aberto", False, error.retry_in))
+        else:
+            logger.error("Erro no job %s para %s (tentativa %s): %s", job_id, dest, attempts, error)
+            self._failed.append((job_id, attempts, str(error), isinstance(error, (Forbidden, BadRequest)), None))
+        self._finished_event.set()
+
+    async def settle(self):
+        """Grava o desfecho dos jobs que terminaram desde a última chamada."""
+        if self._unsure:
+            unsure, self._unsure = self._unsure, []
+            await health.load()  # a quarentena pode ter sido desfeita pelo processo web
+            for job_id, attempts, dest in unsure:
+                if health.is_quarantined(dest):
+                    self._failed.append((job_id, attempts, "destino em quarentena", True, None))
+                else:
+                    self._failed.append((job_id, attempts, "quarentena desfeita", False, 0.0))
+        done, failed = self._done, self._failed
+        if not done and not failed:
+            return
+        self._done, self._failed = [], []
+        try:
+            await run_db(_settle, done, failed)
+        except Exception:
+            self._done[:0], self._failed[:0] = done, failed
+            raise
+
+    async def renew(self):
+        if self._in_flight:
+            await run_db(_renew, list(self._in_flight))
+
+    async def run(self):
+        renewed = time.monotonic()
+        while True:
+            claimed = 0
+            try:
+                with tracing.trace("job_batch"):
+                    claimed = await self.claim()
+                await self.settle()
+                if time.monotonic() - renewed >= JOB_LEASE / 3:
+                    await self.renew()
+                    renewed = time.monotonic()
+            except Exception as e:
+                logger.error("Erro no worker de entregas: %s", e)
+            if not claimed:
+                # nada novo (ou sem vaga): acorda quando algum envio terminar ou no próximo poll
+                self._finished_event.clear()
+                try:
+                    await asyncio.wait_for(self._finished_event.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+
+async def run_worker():
+    logger.info("📦 Worker de entregas iniciado")
+    if WORKER_METRICS_PORT:
+        from prometheus_client import start_http_server
+        start_http_server(WORKER_METRICS_PORT)
+    await asyncio.to_thread(migrations.init_schema)
+    async with BOT:
+        ledger.start()
+        await health.load()
+        asyncio.create_task(health.refresh_loop(HEALTH_REFRESH_INTERVAL))
+        try:
+            await JobRunner().run()
+        finally:
+            await ledger.stop()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker())
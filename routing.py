@@ -0,0 +1,141 @@
+import os, asyncio, logging
+from db import run_db, GroupChannel
+
+logger = logging.getLogger(__name__)
+
+# recarga periódica: pega mudanças feitas por outros processos (ex: quarentena no worker de entregas)
+ROUTING_REFRESH_INTERVAL = float(os.getenv("ROUTING_REFRESH_INTERVAL", "300"))
+
+class RoutingIndex:
+    """
+    Índice em memória: canal de origem -> destinos (já deduplicados) para replicação.
+    Montado no startup e atualizado a cada mudança de participação, para que
+    new_post não precise consultar o banco. Canais em quarentena (active = False)
+    continuam como origem, mas não recebem replicações.
+    """
+
+    def __init__(self):
+        self._groups: dict[int, set[int]] = {}       # grupo -> canais aceitos
+        self._memberships: dict[int, set[int]] = {}  # canal -> grupos
+        self._routes: dict[int, frozenset[int]] = {}
+        self._paused: set[int] = set()               # canais em quarentena: só origem
+        self._listeners = []
+        self._watchers = []
+        self.ready = asyncio.Event()  # setado na primeira carga; new_post espera por ele logo após o boot
+
+    def subscribe(self, listener):
+        """listener() (corrotina) é chamado após add/remove/drop_group/pause/resume — ex: avisar outros workers."""
+        self._listeners.append(listener)
+
+    def watch(self, callback):
+        """callback(group_id, channel_id) síncrono a cada mudança de participação; (None, None) após load."""
+        self._watchers.append(callback)
+
+    def _changed(self):
+        for listener in self._listeners:
+            asyncio.get_running_loop().create_task(listener())
+
+    def _touched(self, group_id, channel_id):
+        for callback in self._watchers:
+            callback(group_id, channel_id)
+
+    def destinations(self, channel_id: int) -> frozenset[int]:
+        return self._routes.get(channel_id, frozenset())
+
+    def _recompute(self, channel_ids):
+        for cid in channel_ids:
+            gids = self._memberships.get(cid)
+            if not gids:
+                self._memberships.pop(cid, None)
+                self._routes.pop(cid, None)
+                continue
+            dests = set()
+            for gid in gids:
+                dests |= self._groups.get(gid, set())
+            dests.discard(cid)
+            dests -= self._paused
+            self._routes[cid] = frozenset(dests)
+
+    def _peers(self, channel_id: int) -> set[int]:
+        peers = set()
+        for gid in self._memberships.get(channel_id, ()):
+            peers |= self._groups.get(gid, set())
+        return peers
+
+    def load(self, rows):
+        """Substitui o índice inteiro a partir de (group_id, channel_id, active) aceitos."""
+        groups, memberships, paused = {}, {}, set()
+        for gid, cid, active in rows:
+            groups.setdefault(gid, set()).add(cid)
+            memberships.setdefault(cid, set()).add(gid)
+            if not active:
+                paused.add(cid)
+        self._groups, self._memberships, self._routes, self._paused = groups, memberships, {}, paused
+        self._recompute(list(memberships))
+        self._touched(None, None)
+        self.ready.set()
+
+    def add(self, group_id: int, channel_id: int):
+        members = self._groups.setdefault(group_id, set())
+        members.add(channel_id)
+        self._memberships.setdefault(channel_id, set()).add(group_id)
+        self._recompute(list(members))
+        self._touched(group_id, channel_id)
+        self._changed()
+
+    def remove(self, group_id: int, channel_id: int):
+        self._touched(group_id, channel_id)  # mesmo fora do índice
+        members = self._groups.get(group_id)
+        if not members or channel_id not in members:
+            return
+        members.discard(channel_id)
+        self._memberships.get(channel_id, set()).discard(group_id)
+        if not members:
+            del self._groups[group_id]
+        self._recompute(list(members) + [channel_id])
+        self._changed()
+
+    def drop_group(self, group_id: int):
+        members = self._groups.pop(group_id, set())
+        self._touched(group_id, None)
+        for cid in members:
+            self._memberships.get(cid, set()).discard(group_id)
+            self._touched(None, cid)
+        self._recompute(list(members))
+        self._changed()
+
+    def pause(self, channel_id: int):
+        """Quarentena: o canal deixa de ser destino, mas segue replicando os próprios posts."""
+        if channel_id in self._paused:
+            return
+        self._paused.add(channel_id)
+        self._recompute(self._peers(channel_id))
+        for gid in self._memberships.get(channel_id, ()):
+            self._touched(gid, channel_id)
+        self._changed()
+
+    def resume(self, channel_id: int):
+        if channel_id not in self._paused:
+            return
+        self._paused.discard(channel_id)
+        self._recompute(self._peers(channel_id))
+        for gid in self._memberships.get(channel_id, ()):
+            self._touched(gid, channel_id)
+        self._changed()
+
+    async def rebuild(self):
+        rows = await run_db(lambda sess: sess.query(GroupChannel.group_id, GroupChannel.channel_id,
+                                                    GroupChannel.active)
+                            .filter_by(accepted=True).all())
+        self.load(rows)
+        logger.info("🧭 Índice de rotas carregado: %d canais", len(self._routes))
+
+    async def refresh_loop(self, interval: float = ROUTING_REFRESH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error("Erro ao recarregar índice de rotas: %s", e)
+
+routing = RoutingIndex()
@@ -0,0 +1,74 @@
+import os, json, logging
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from cache import TTLCache
+from db import run_db, utcnow, ConversationState
+
+logger = logging.getLogger(__name__)
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")  # memory ou db (compartilhado entre workers)
+STATE_TTL = int(os.getenv("STATE_TTL", "3600"))
+STATE_MAX_USERS = int(os.getenv("STATE_MAX_USERS", "50000"))
+
+class StateStore(ABC):
+    """Estado de conversa por usuário (ex: aguardando nome do grupo)."""
+
+    @abstractmethod
+    async def get(self, user_id: int) -> dict | None: ...
+
+    @abstractmethod
+    async def set(self, user_id: int, state: dict): ...
+
+    @abstractmethod
+    async def pop(self, user_id: int): ...
+
+class MemoryStateStore(StateStore):
+    """Em memória do processo, com expiração e limite de usuários (LRU)."""
+
+    def __init__(self, ttl: float = STATE_TTL, max_size: int = STATE_MAX_USERS):
+        self._cache = TTLCache(ttl, max_size)
+
+    async def get(self, user_id):
+        return self._cache.get(user_id)
+
+    async def set(self, user_id, state):
+        self._cache.set(user_id, state)
+
+    async def pop(self, user_id):
+        self._cache.pop(user_id)
+
+class DBStateStore(StateStore):
+    """Na tabela conversation_states: visível para todos os workers que usam o mesmo banco."""
+
+    PRUNE_EVERY = 500
+
+    def __init__(self, ttl: float = STATE_TTL):
+        self.ttl = ttl
+        self._writes = 0
+
+    async def get(self, user_id):
+        def _get(sess):
+            row = sess.get(ConversationState, user_id)
+            if row and row.expires_at > utcnow():
+                return json.loads(row.data)
+        return await run_db(_get)
+
+    async def set(self, user_id, state):
+        data = json.dumps(state)
+        expires_at = utcnow() + timedelta(seconds=self.ttl)
+        await run_db(lambda sess: sess.merge(ConversationState(user_id=user_id, data=data, expires_at=expires_at)))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            await self.prune()
+
+    async def pop(self, user_id):
+        await run_db(lambda sess: sess.query(ConversationState).filter_by(user_id=user_id).delete())
+
+    async def prune(self):
+        removed = await run_db(lambda sess: sess.query(ConversationState)
+                               .filter(ConversationState.expires_at <= utcnow()).delete())
+        if removed:
+            logger.info("🧹 %d estados de conversa expirados removidos", removed)
+
+def from_env() -> StateStore:
+    return DBStateStore() if STATE_BACKEND == "db" else MemoryStateStore()
@@ -0,0 +1,151 @@
+import os, sys, time, random, logging, threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))      # fração dos updates rastreados (0 = desligado)
+SLOW_UPDATE_SECONDS = float(os.getenv("SLOW_UPDATE_SECONDS", "2"))  # trace acima disso vai para o log
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN") or None                  # sem token, /debug/profile fica desligado
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+
+_current: ContextVar = ContextVar("trace_span", default=None)
+
+class Span:
+    """Trecho cronometrado de um trace; filhos são anexados por span() e record()."""
+
+    __slots__ = ("name", "attrs", "start", "end", "children")
+
+    def __init__(self, name: str, attrs: dict, start: float | None = None):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter() if start is None else start
+        self.end = None
+        self.children: list[Span] = []
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def totals(self, acc: Counter | None = None) -> Counter:
+        """Tempo e contagem por categoria (prefixo do nome: db, api, send...)."""
+        acc = Counter() if acc is None else acc
+        for child in self.children:
+            kind = child.name.split(" ", 1)[0]
+            acc[kind] += child.duration
+            acc[kind + "#"] += 1
+            child.totals(acc)
+        return acc
+
+    def render(self, depth: int = 0, lines: list | None = None) -> list[str]:
+        lines = [] if lines is None else lines
+        attrs = " ".join(f"{k}={v}" for k, v in self.attrs.items())
+        lines.append(f"{'  ' * depth}{self.name} {self.duration * 1000:.1f}ms {attrs}".rstrip())
+        for child in sorted(self.children, key=lambda s: s.start):
+            child.render(depth + 1, lines)
+        return lines
+
+def current() -> Span | None:
+    return _current.get()
+
+@contextmanager
+def trace(name: str, **attrs):
+    """Raiz de um trace (um update), amostrada por TRACE_SAMPLE_RATE; traces lentos vão para o log."""
+    if not TRACE_SAMPLE_RATE or random.random() >= TRACE_SAMPLE_RATE:
+        token = _current.set(None)  # não herda o trace de quem criou a tarefa
+        try:
+            yield None
+        finally:
+            _current.reset(token)
+        return
+    root = Span(name, attrs)
+    token = _current.set(root)
+    try:
+        yield root
+    finally:
+        root.end = time.perf_counter()
+        _current.reset(token)
+        if root.duration >= SLOW_UPDATE_SECONDS:
+            totals = root.totals()
+            summary = ", ".join(f"{k} {totals[k + '#']}x {totals[k] * 1000:.0f}ms"
+                                for k in sorted(k for k in totals if not k.endswith("#")))
+            logger.warning("🐢 %s lento: %.2fs (%s)\n%s", name, root.duration, summary, "\n".join(root.render()))
+
+@contextmanager
+def span(name: str, **attrs):
+    """Trecho filho do span atual; não faz nada fora de um trace amostrado."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attrs)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    finally:
+        child.end = time.perf_counter()
+        _current.reset(token)
+
+@contextmanager
+def activate(parent: Span | None):
+    """Retoma um span capturado em outra tarefa (ex: envio feito pela fila do scheduler)."""
+    token = _current.set(parent)
+    try:
+        yield parent
+    finally:
+        _current.reset(token)
+
+def record(name: str, start: float, **attrs):
+    """Anexa um trecho já concluído (início em perf_counter) ao span atual."""
+    parent = _current.get()
+    if parent is not None:
+        child = Span(name, attrs, start)
+        child.end = time.perf_counter()
+        parent.children.append(child)
+
+def update_kind(update) -> str:
+    for kind in ("callback_query", "channel_post", "edited_channel_post", "message", "my_chat_member"):
+        if getattr(update, kind, None) is not None:
+            return kind
+    return "update"
+
+# 🔬 Profiler por amostragem, ligado sob demanda por uma janela fixa (GET /debug/profile)
+class SamplingProfiler:
+    """
+    Amostra as pilhas de todas as threads a cada `interval` segundos e devolve
+    as pilhas agregadas no formato "collapsed" (uma linha por pilha, contagem no fim),
+    pronto para flamegraph.pl / speedscope.
+    """
+
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def run(self, seconds: float) -> str:
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("profiler já em execução")
+        try:
+            stacks: Counter = Counter()
+            me = threading.get_ident()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            deadline = time.monotonic() + min(seconds, PROFILE_MAX_SECONDS)
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        code = frame.f_code
+                        frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    frames.append(names.get(ident, str(ident)))
+                    stacks[";".join(reversed(frames))] += 1
+                time.sleep(self.interval)
+            return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common())
+        finally:
+            self._lock.release()
+
+profiler = SamplingProfiler()